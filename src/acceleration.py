@@ -0,0 +1,82 @@
+import numpy as np
+
+# Anderson acceleration of the reflective boundary iteration.
+#
+# One Sn iteration maps the boundary angular fluxes x (the mesh ang_flux
+# edge buffers) to new boundary fluxes g = G(x). Plain iteration takes
+# x = g; Anderson mixing instead combines the last few (x, g) pairs so the
+# new x minimizes the linearized residual g - x. With a fixed source and
+# no scattering G is affine, and with an unlimited depth Anderson mixing
+# is equivalent to GMRES on (I - A) x = c, so the depth sets how much of
+# the Krylov space is kept.
+
+
+class AndersonMixer(object):
+
+    # depth        number of previous iterates used in the mixing
+    # patience     iterations the residual may fail to decrease before the
+    #              history is dropped and mixing restarts
+    # max_restarts restarts allowed before falling back to plain iteration
+    def __init__(self, depth=5, patience=3, max_restarts=2):
+
+        self.depth = depth
+        self.patience = patience
+        self.max_restarts = max_restarts
+
+        self.active = True
+        self.restarts = 0
+        self.stalls = 0
+        self.residual_history = []
+
+        self.x_history = []
+        self.g_history = []
+
+    # drop the stored iterates
+    def restart(self):
+
+        self.x_history = []
+        self.g_history = []
+
+    # get the next boundary fluxes given the current ones (x) and their
+    # image after one iteration (g)
+    def update(self, x, g):
+
+        x = np.array(x, dtype=float).ravel()
+        g = np.array(g, dtype=float).ravel()
+        residual = np.linalg.norm(g - x)
+
+        # count iterations where the residual does not decrease and fall
+        # back to plain iteration when mixing keeps failing
+        if self.residual_history and residual >= self.residual_history[-1]:
+            self.stalls += 1
+        else:
+            self.stalls = 0
+        self.residual_history.append(residual)
+
+        if self.active and self.stalls >= self.patience:
+            self.stalls = 0
+            self.restarts += 1
+            self.restart()
+            if self.restarts > self.max_restarts:
+                self.active = False
+
+        if not self.active:
+            return g
+
+        self.x_history.append(x)
+        self.g_history.append(g)
+        if len(self.x_history) > self.depth + 1:
+            self.x_history.pop(0)
+            self.g_history.pop(0)
+
+        if len(self.x_history) == 1:
+            return g
+
+        # differences of the residuals and images over the stored iterates
+        f = [gi - xi for xi, gi in zip(self.x_history, self.g_history)]
+        delta_f = np.array([f[i+1] - f[i] for i in range(len(f) - 1)]).T
+        delta_g = np.array([self.g_history[i+1] - self.g_history[i] for i in range(len(f) - 1)]).T
+
+        gamma = np.linalg.lstsq(delta_f, f[-1], rcond=None)[0]
+
+        return g - np.dot(delta_g, gamma)
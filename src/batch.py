@@ -0,0 +1,259 @@
+import numpy as np
+import sweeper
+import acceleration
+from discrete_ordinates import QUADRANTS
+
+# Batched solves of pin cell variants.
+#
+# Dancoff factor tables need many pin cells that share a quadrature order
+# and mesh width but differ in pitch, fuel diameter or cross sections. A
+# VariantBatch stacks the angular fluxes and cell sources of K such meshes
+# along a variant axis after the cell axes (before the group axis of a
+# multigroup problem) and sweeps all of them in one pass over the
+# anti-diagonals, so the loop and kernel overheads are shared.
+#
+# Each mesh keeps its own materials, tallies and convergence state: while
+# the batch is solved its flux arrays are views onto the stacked arrays, and
+# the sources, tallies, DSA and boundary mixing of each variant are done by
+# the mesh itself. The batch sweep map numbers the combinations of the
+# variants' sweep maps found in the cells, so the stacked denominator table
+# is indexed [combination, variant, ..., angle]. A variant that has
+# converged drops out and the rest are stacked again.
+
+# the mesh arrays stacked along the variant axis (axis 2 of each)
+STACKED_ARRAYS = ['ang_flux', 'cell_ang_flux', 'cell_source']
+
+# the accelerations of the variants a batch can solve ('auto' picks one of
+# the others, see Mesh)
+ACCELERATIONS = (None, 'anderson', 'auto')
+
+
+class VariantBatch(object):
+
+    # meshes       the variants, with their materials set up. They need the
+    #              same width, quadrature order, number of groups and dtype,
+    #              and must sweep the whole mesh with the angular fluxes
+    #              stored. Plots and checkpoints are not written.
+    def __init__(self, meshes):
+
+        meshes = list(meshes)
+        if not meshes:
+            raise ValueError('a batch needs at least one mesh')
+
+        first = meshes[0]
+        for mesh in meshes:
+            if (mesh.width, mesh.order, mesh.num_groups, mesh.dtype) != \
+               (first.width, first.order, first.num_groups, first.dtype):
+                raise ValueError('the meshes of a batch need the same width, order, number of groups and dtype')
+            if mesh.symmetry is not None or mesh.low_memory:
+                raise ValueError('batched meshes must sweep the whole mesh and store the angular fluxes')
+
+        self.meshes       = meshes
+        self.active       = []
+        self.coefficients = None
+
+    # stack the arrays of the given meshes and point the meshes at their
+    # slices of the stacked arrays
+    def stack(self, meshes):
+
+        self.active = list(meshes)
+        self.coefficients = None
+
+        for name in STACKED_ARRAYS:
+            stacked = None
+            if self.active:
+                stacked = np.stack([getattr(mesh, name) for mesh in self.active], axis=2)
+            setattr(self, name, stacked)
+
+        self.point()
+
+    # point the active meshes at their slices of the stacked arrays
+    def point(self):
+
+        for name in STACKED_ARRAYS:
+            stacked = getattr(self, name)
+            for k, mesh in enumerate(self.active):
+                setattr(mesh, name, stacked[:, :, k])
+
+    # give the given meshes private copies of their arrays and stack the
+    # rest of the active meshes again
+    def drop(self, meshes):
+
+        if not meshes:
+            return
+
+        for mesh in meshes:
+            for name in STACKED_ARRAYS:
+                setattr(mesh, name, getattr(mesh, name).copy())
+
+        self.stack([mesh for mesh in self.active if not any(mesh is dropped for dropped in meshes)])
+
+    # get the stacked streaming coefficients and denominator table of the
+    # active variants, building them and the batch sweep map when a
+    # variant's coefficients change (see Mesh.sweepCoefficients). The
+    # streaming coefficients are given for each column and row, as on a
+    # graded mesh, so the variants may have different cell sizes.
+    def sweepCoefficients(self):
+
+        tables = [mesh.sweepCoefficients() for mesh in self.active]
+        key = tuple(mesh.coefficients[0] for mesh in self.active)
+
+        if self.coefficients is None or self.coefficients[0] != key:
+            width = self.active[0].width
+            batch = (1,) * len(self.active[0].batchShape())
+
+            def perCell(coef):
+                if np.ndim(coef) == 1:
+                    coef = np.broadcast_to(coef.reshape(batch + (-1,)), (width,) + batch + coef.shape[-1:])
+                return coef
+
+            mu_coef = np.stack([perCell(table[0]) for table in tables], axis=1)
+            eta_coef = np.stack([perCell(table[1]) for table in tables], axis=1)
+
+            maps = np.stack([mesh.sweep_map for mesh in self.active], axis=-1).reshape(-1, len(self.active))
+            combinations, sweep_map = np.unique(maps, axis=0, return_inverse=True)
+            self.sweep_map = sweep_map.reshape(width, width).astype(np.int32)
+            denom = np.stack([table[2][combinations[:, k]] for k, table in enumerate(tables)], axis=1)
+
+            self.coefficients = (key, (mu_coef, eta_coef, denom))
+
+        return self.coefficients[1]
+
+    # sweep all four quadrants of the active variants once, reflecting the
+    # boundary angular fluxes for the reflective boundary case
+    def sweepAll(self, update):
+
+        for mesh in self.active:
+            mesh.updateSource()
+            mesh.tallies = None
+
+        self.sweepQuadrants(self.sweepCoefficients(), update)
+
+        for mesh in self.active:
+            mesh.stats.count('sweeps')
+            mesh.stats.count('cell_angle_updates', mesh.flux.size * mesh.num_angles)
+
+    # sweep the quadrants of the stacked arrays one after the other,
+    # reflecting the boundary angular fluxes of each if update is set
+    def sweepQuadrants(self, coefficients, update):
+
+        mu_coef, eta_coef, denom = coefficients
+        for quadrant in QUADRANTS:
+            sweeper.sweepWavefront(*sweeper.quadrantViews(self.ang_flux, self.cell_ang_flux, self.sweep_map,
+                                                          self.cell_source, quadrant),
+                                   *sweeper.coefficientViews(denom, mu_coef, eta_coef, quadrant))
+
+            if update:
+                for mesh in self.active:
+                    mesh.reflectQuadrant(quadrant)
+
+    # solve the Sn problem of every variant (see Mesh.solveSn)
+    def solveSn(self, update, num_iter=1):
+
+        for mesh in self.meshes:
+            mesh.updateMaterials()
+            if mesh.acceleration not in ACCELERATIONS:
+                raise ValueError('batched solves do not support acceleration ' + str(mesh.acceleration))
+
+        self.stack(self.meshes)
+        try:
+            if update:
+                self.iterateReflective(num_iter)
+            else:
+                self.solveVacuum()
+        finally:
+            self.drop(self.active)
+
+        for mesh in self.meshes:
+            mesh.stats.emit('solve', {'update': update, 'num_iterations': getattr(mesh, 'num_iterations', None),
+                                      'converged': getattr(mesh, 'converged', None)})
+
+    # solve the vacuum boundary problem of every variant, repeating the
+    # sweeps until the downscatter sources are resolved and the scattering
+    # source iteration is converged (see Mesh.sweepVacuum); each variant
+    # drops out when its source iteration is done
+    def solveVacuum(self):
+
+        for mesh in self.active:
+            mesh.source_iterations = 0
+
+        sweep = 0
+        while self.active:
+            previous = [mesh.scalar_flux for mesh in self.active]
+            self.ang_flux[...] = 0.0
+            self.sweepAll(False)
+
+            finished = []
+            for mesh, old in zip(self.active, previous):
+                mesh.scalar_flux = mesh.integrateFlux()
+                mesh.source_iterations += 1
+                mesh.stats.count('source_iterations')
+
+                passes = mesh.scatterPasses()
+                done = sweep + 1 >= passes
+                if mesh.mat_sigma_s is not None:
+                    change = mesh.fluxChange(old)
+                    if mesh.dsa:
+                        mesh.accelerateScattering(old, 'vacuum')
+                    done = done and change < mesh.tol
+                    if not done and sweep + 1 >= max(passes, mesh.max_source_iterations):
+                        mesh.log('source iteration not converged after ' + str(sweep + 1) + ' sweeps ' + str(change))
+                        done = True
+
+                # keep the fuel rxn rate and zero out the angular flux
+                if done:
+                    mesh.RR_isolated = mesh.computeTallies()['RR_fuel']
+                    mesh.ang_flux[...] = 0.0
+                    mesh.stats.count('iterations')
+                    mesh.stats.emit('iteration', {'iteration': 0, 'update': False, 'eps': 1.0, 'converged': False})
+                    finished.append(mesh)
+
+            self.drop(finished)
+            sweep += 1
+
+    # run up to num_iter reflective boundary iterations; each variant drops
+    # out when it has converged (see Mesh.iterateSn)
+    def iterateReflective(self, num_iter):
+
+        mixers = {}
+        for mesh in self.active:
+            mesh.eps_history = []
+            mesh.residual_history = []
+            if mesh.acceleration == 'anderson':
+                mixers[id(mesh)] = acceleration.AndersonMixer(mesh.anderson_depth)
+
+        for iteration in range(num_iter):
+            if not self.active:
+                break
+
+            states = [mesh.iterationState() for mesh in self.active]
+            previous = [mesh.scalar_flux for mesh in self.active]
+            self.sweepAll(True)
+
+            finished = []
+            for mesh, state, old in zip(self.active, states, previous):
+                tallies = mesh.computeTallies()
+
+                if mesh.mat_sigma_s is not None and mesh.dsa:
+                    mesh.accelerateScattering(old, 'reflective')
+
+                mixer = mixers.get(id(mesh))
+                if mixer is not None:
+                    mesh.setIterationState(mixer.update(state, mesh.iterationState()))
+                else:
+                    mesh.residual_history.append(np.linalg.norm(mesh.iterationState() - state))
+
+                eps = tallies['eps']
+                mesh.eps_history.append(eps)
+                mesh.stats.append('eps', eps)
+
+                converged = eps < mesh.tol
+                mesh.stats.count('iterations')
+                mesh.stats.emit('iteration', {'iteration': iteration, 'update': True, 'eps': eps,
+                                              'converged': converged})
+
+                if converged or iteration == num_iter - 1:
+                    mesh.finishReflective(tallies, eps, converged, iteration, mixer)
+                    finished.append(mesh)
+
+            self.drop(finished)
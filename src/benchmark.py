@@ -0,0 +1,293 @@
+import numpy as np
+import contextlib
+import getopt
+import io
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from discrete_ordinates import Mesh, QUADRANTS
+from material import Material
+import plotter
+
+# Benchmark suite for the Sn solver.
+#
+# Each case (quadrature order, mesh size) times the mesh setup, one
+# quadrant sweep, the vacuum solve, one full reflective iteration (both
+# including the tallies), the tallies on their own and the scalar flux
+# plot, and measures the peak memory of a setup, vacuum solve and one
+# reflective iteration. The results are written as JSON so runs can be
+# compared with a baseline:
+#
+#   python benchmark.py -f new.json -b old.json
+#
+# Timings are the best of a number of repeats, so they are not skewed by
+# one-off costs such as quadrature table setup. Cases run in a reduced
+# precision (-p float32) also report how far their fluxes and Dancoff factor
+# drift from the float64 results.
+
+# bump when the benchmark cases or measurements change
+BENCHMARK_VERSION = 2
+
+DEFAULT_ORDERS = [2, 4, 8, 12, 16, 20, 24]
+DEFAULT_MESH_SIZES = [0.06, 0.02, 0.01]
+
+# reflective iterations run to compare a reduced precision case with float64
+DRIFT_ITERATIONS = 10
+
+
+# get the best wall-clock time of repeated calls to fn; setup is called
+# before each call and its result passed to fn
+def bestTime(fn, repeats, setup=None):
+
+    best = None
+    for repeat in range(repeats):
+        args = () if setup is None else (setup(),)
+        start = time.perf_counter()
+        fn(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+
+# create a run_script pin cell mesh with its materials
+def makeMesh(order, mesh_size, materials=True, **options):
+
+    mesh = Mesh(mesh_size, order, 1e-4, plot_policy='none', **options)
+    if materials:
+        setMaterials(mesh)
+
+    return mesh
+
+
+# give a mesh the run_script fuel and moderator
+def setMaterials(mesh):
+
+    mesh.setFuel(Material('fuel', 100.0, 1.0/(4.0*np.pi)))
+    mesh.setModerator(Material('moderator', 0.25, 0.0))
+    mesh.makeMeshMaterials()
+
+
+# run the vacuum solve without printing
+def solveVacuum(mesh):
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        mesh.solveSn(False, 1)
+
+
+# run num_iter reflective iterations without printing
+def iterate(mesh, num_iter=1):
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        mesh.solveSn(True, num_iter)
+
+
+# get the peak traced memory in bytes of setting up a mesh and running the
+# vacuum solve and one reflective iteration
+def peakMemory(order, mesh_size, **options):
+
+    tracemalloc.start()
+    try:
+        mesh = makeMesh(order, mesh_size, **options)
+        solveVacuum(mesh)
+        iterate(mesh)
+        mesh.close()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return peak
+
+
+# get the difference of the normalized scalar flux, fuel rxn rate and
+# Dancoff factor of a case from the float64 results after a vacuum solve
+# and DRIFT_ITERATIONS reflective iterations
+def precisionDrift(order, mesh_size, **options):
+
+    results = []
+    for dtype in (options.get('dtype', np.float64), np.float64):
+        mesh = makeMesh(order, mesh_size, **dict(options, dtype=dtype))
+        solveVacuum(mesh)
+        iterate(mesh, DRIFT_ITERATIONS)
+        mesh.close()
+        results.append(mesh)
+
+    mesh, reference = results
+    drift = {}
+    drift['flux'] = float(np.max(np.abs(mesh.flux - reference.flux)))
+    drift['RR_fuel'] = float(np.max(np.abs(mesh.RR_lattice / reference.RR_lattice - 1.0)))
+    drift['dancoff'] = float(np.max(np.abs(mesh.dancoff - reference.dancoff)))
+
+    return drift
+
+
+# benchmark one case and return its results
+def benchmarkCase(order, mesh_size, repeats=3, **options):
+
+    timings = {}
+    timings['init'] = bestTime(lambda: Mesh(mesh_size, order, 1e-4, plot_policy='none', **options), repeats)
+    timings['materials'] = bestTime(setMaterials, repeats,
+                                    lambda: makeMesh(order, mesh_size, materials=False, **options))
+
+    mesh = makeMesh(order, mesh_size, **options)
+    mesh.updateMaterials()
+    mesh.updateSource()
+    timings['quadrant_sweep'] = bestTime(lambda: mesh.sweepQuadrant(QUADRANTS[0]), repeats)
+    timings['vacuum'] = bestTime(lambda: solveVacuum(mesh), repeats)
+    timings['iteration'] = bestTime(lambda: iterate(mesh), repeats)
+
+    def tallies():
+        mesh.tallies = None
+        mesh.computeTallies()
+    timings['tallies'] = bestTime(tallies, repeats)
+
+    # write the plots to a scratch directory
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as scratch:
+        os.chdir(scratch)
+        try:
+            timings['plot'] = bestTime(lambda: plotter.plotScalarFlux(mesh, order, mesh_size, 0), repeats)
+        finally:
+            os.chdir(cwd)
+
+    mesh.close()
+
+    # every sweep updates each cell once for each angle (and group)
+    updates = mesh.width**2 * mesh.num_angles * mesh.num_groups
+
+    results = {}
+    results['order'] = order
+    results['mesh_size'] = mesh_size
+    results['options'] = options
+    results['width'] = mesh.width
+    results['num_angles'] = mesh.num_angles
+    results['num_groups'] = mesh.num_groups
+    results['timings'] = timings
+    results['sweep_updates_per_second'] = updates / 4 / timings['quadrant_sweep']
+    results['iteration_updates_per_second'] = updates / timings['iteration']
+    results['peak_memory'] = peakMemory(order, mesh_size, **options)
+    if np.dtype(options.get('dtype', np.float64)) != np.float64:
+        results['drift'] = precisionDrift(order, mesh_size, **options)
+
+    return results
+
+
+# benchmark every combination of the given orders and mesh sizes
+def runBenchmarks(orders=DEFAULT_ORDERS, mesh_sizes=DEFAULT_MESH_SIZES, repeats=3, verbose=True, **options):
+
+    cases = []
+    for mesh_size in mesh_sizes:
+        for order in orders:
+            results = benchmarkCase(order, mesh_size, repeats, **options)
+            cases.append(results)
+            if verbose:
+                print('benchmark: order {:2d} mesh_size {} width {:3d} sweep {:.3e} s iteration {:.3e} s '
+                      '{:.3e} updates/s peak {:.1f} MB'.format(
+                          order, mesh_size, results['width'], results['timings']['quadrant_sweep'],
+                          results['timings']['iteration'], results['iteration_updates_per_second'],
+                          results['peak_memory'] / 2.0**20))
+                if 'drift' in results:
+                    print('benchmark: order {:2d} mesh_size {} drift from float64: flux {:.2e} RR_fuel {:.2e} '
+                          'dancoff {:.2e}'.format(order, mesh_size, results['drift']['flux'],
+                                                  results['drift']['RR_fuel'], results['drift']['dancoff']))
+
+    report = {}
+    report['version'] = BENCHMARK_VERSION
+    report['time'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+    report['machine'] = {'platform': platform.platform(), 'python': platform.python_version(),
+                         'numpy': np.__version__, 'cpu_count': os.cpu_count()}
+    report['max_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    report['cases'] = cases
+
+    return report
+
+
+# get the options that differ between a baseline case and a case as
+# 'name old -> new' strings (options not given are 'default')
+def optionChanges(old, new):
+
+    changes = []
+    for name in sorted(set(old) | set(new)):
+        if old.get(name) != new.get(name):
+            changes.append('{} {} -> {}'.format(name, old.get(name, 'default'), new.get(name, 'default')))
+
+    return changes
+
+
+# print the speedup of each timing of a report over a baseline report
+# (values above 1 are faster than the baseline). Cases are matched on the
+# order and mesh size, preferring a baseline case with the same options,
+# and any option that differs (e.g. the dtype) is printed with them.
+def compareReports(baseline, report):
+
+    old_cases = {}
+    for case in baseline['cases']:
+        old_cases.setdefault((case['order'], case['mesh_size']), []).append(case)
+
+    for case in report['cases']:
+        candidates = old_cases.get((case['order'], case['mesh_size']))
+        if not candidates:
+            continue
+        options = case.get('options', {})
+        old = next((old for old in candidates if old.get('options', {}) == options), candidates[0])
+
+        speedups = ['{} {:.2f}x'.format(name, old['timings'][name] / new)
+                    for name, new in sorted(case['timings'].items()) if name in old['timings'] and new > 0]
+        memory = old['peak_memory'] / max(case['peak_memory'], 1)
+        changes = optionChanges(old.get('options', {}), options)
+        print('compare: order {:2d} mesh_size {} {} memory {:.2f}x{}'.format(
+            case['order'], case['mesh_size'], ' '.join(speedups), memory,
+            ' (' + ', '.join(changes) + ')' if changes else ''))
+
+
+def main(argv):
+
+    usage = 'benchmark.py [-o orders] [-m mesh_sizes] [-r repeats] [-p dtype] [-f output.json] [-b baseline.json]'
+    orders = DEFAULT_ORDERS
+    mesh_sizes = DEFAULT_MESH_SIZES
+    repeats = 3
+    output = 'benchmark.json'
+    baseline = None
+    options = {}
+
+    try:
+        opts, args = getopt.getopt(argv, 'ho:m:r:p:f:b:')
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        elif opt == '-o':
+            orders = [int(order) for order in arg.split(',')]
+        elif opt == '-m':
+            mesh_sizes = [float(mesh_size) for mesh_size in arg.split(',')]
+        elif opt == '-r':
+            repeats = int(arg)
+        elif opt == '-p':
+            options['dtype'] = arg
+        elif opt == '-f':
+            output = arg
+        elif opt == '-b':
+            baseline = arg
+
+    report = runBenchmarks(orders, mesh_sizes, repeats, **options)
+
+    with open(output, 'w') as output_file:
+        json.dump(report, output_file, sort_keys=True, indent=1)
+
+    if baseline is not None:
+        with open(baseline) as baseline_file:
+            compareReports(json.load(baseline_file), report)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
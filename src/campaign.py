@@ -0,0 +1,341 @@
+import numpy as np
+import contextlib
+import hashlib
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import time
+from discrete_ordinates import Mesh
+from material import Material
+from batch import VariantBatch, ACCELERATIONS
+
+# Campaign runner for order / mesh size / geometry scans.
+#
+# A case is a plain dictionary describing one pin cell calculation (see
+# makeCase). Each case is run as a vacuum solve followed by a reflective
+# solve, and its results are stored in an on-disk cache under the SHA-256
+# of the case, so repeated or extended scans only compute new points.
+# Cases that only differ in pitch, fuel diameter, geometry or materials can
+# be solved together in batches (see batch).
+
+# bump when a change to the solver invalidates cached results
+CACHE_VERSION = 2
+
+# fuel and moderator used by run_script
+DEFAULT_MATERIALS = {'fuel':      {'sigma_t': 100.0, 'source': 1.0/(4.0*np.pi)},
+                     'moderator': {'sigma_t': 0.25,  'source': 0.0}}
+
+
+# describe one case; extra keyword arguments are passed on to Mesh
+# (e.g. acceleration='anderson'), and regions lists extra
+# (diameter, name, sigma_t, source) regions around the fuel. The
+# reflective solve is stopped early when eps has not reached a new low for
+# stall_iterations iterations or has grown to divergence times its lowest
+# value (see watchSolve).
+def makeCase(order, mesh_size, pitch=1.26, fuel_diameter=0.70, geometry='square',
+             materials=DEFAULT_MATERIALS, regions=(), tolerance=1e-4, num_iter=50,
+             stall_iterations=None, divergence=None, **options):
+
+    case = {}
+    case['order'] = int(order)
+    case['mesh_size'] = float(mesh_size)
+    case['pitch'] = float(pitch)
+    case['fuel_diameter'] = float(fuel_diameter)
+    case['geometry'] = geometry
+    case['materials'] = {name: {'sigma_t': float(mat['sigma_t']), 'source': float(mat['source'])}
+                         for name, mat in materials.items()}
+    case['regions'] = [[float(d), name, float(sigma_t), float(source)] for d, name, sigma_t, source in regions]
+    case['tolerance'] = float(tolerance)
+    case['num_iter'] = int(num_iter)
+    case['options'] = {name: optionValue(name, value) for name, value in options.items()}
+    case['stop'] = {'stall_iterations': stall_iterations, 'divergence': divergence}
+
+    return case
+
+
+# get a Mesh option as a value that can be stored as JSON: dtypes by name
+# (e.g. 'float32'), arrays (e.g. graded cell widths) as lists and numpy
+# scalars as Python numbers
+def optionValue(name, value):
+
+    if name == 'dtype':
+        return np.dtype(value).name
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    if isinstance(value, (list, tuple)):
+        return [optionValue(None, item) for item in value]
+
+    return value
+
+
+# describe every combination of the given orders, mesh sizes, pitches,
+# fuel diameters, geometries and material sets
+def makeCases(orders, mesh_sizes, pitches=(1.26,), fuel_diameters=(0.70,), geometries=('square',),
+              materials=(DEFAULT_MATERIALS,), **kwargs):
+
+    cases = []
+    for order, mesh_size, pitch, fuel_diameter, geometry, mats in itertools.product(
+            orders, mesh_sizes, pitches, fuel_diameters, geometries, materials):
+        cases.append(makeCase(order, mesh_size, pitch, fuel_diameter, geometry, mats, **kwargs))
+
+    return cases
+
+
+# get the content address of a case
+def caseKey(case):
+
+    text = json.dumps({'version': CACHE_VERSION, 'case': case}, sort_keys=True)
+
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+# create the mesh of a case with its materials
+def makeMesh(case):
+
+    options = {'plot_policy': 'none'}
+    options.update(case['options'])
+
+    # a case run on the campaign pool is in a daemonic process, which
+    # cannot start a sweep pool of its own
+    if multiprocessing.current_process().daemon:
+        options['num_workers'] = 1
+    mesh = Mesh(case['mesh_size'], case['order'], case['tolerance'], pitch=case['pitch'],
+                fuel_diameter=case['fuel_diameter'], geometry=case['geometry'], **options)
+
+    mats = case['materials']
+    mesh.setFuel(Material('fuel', mats['fuel']['sigma_t'], mats['fuel']['source']))
+    mesh.setModerator(Material('moderator', mats['moderator']['sigma_t'], mats['moderator']['source']))
+    for diameter, name, sigma_t, source in case['regions']:
+        mesh.addRegion(diameter, Material(name, sigma_t, source))
+    mesh.makeMeshMaterials()
+
+    return mesh
+
+
+# get the results of a solved case; stopped gives why the reflective
+# solve was stopped early, if it was (see watchSolve)
+def caseResults(mesh, timings, stopped=None):
+
+    results = {}
+    results['RR_isolated'] = float(mesh.RR_isolated)
+    results['RR_lattice'] = float(mesh.RR_lattice)
+    results['dancoff'] = float(mesh.dancoff)
+    results['flux_ratio'] = float(mesh.flux_ratio)
+    results['converged'] = bool(mesh.converged)
+    results['num_iterations'] = int(mesh.num_iterations)
+    results['stopped'] = stopped
+    results['timings'] = timings
+
+    return results
+
+
+# run one case and return its results
+def runCase(case, verbose=False):
+
+    timings = {}
+    output = io.StringIO()
+    redirect = contextlib.redirect_stdout(output) if not verbose else contextlib.nullcontext()
+
+    with redirect:
+        start = time.time()
+        mesh = makeMesh(case)
+        timings['setup'] = time.time() - start
+
+        # solve the vacuum boundary Sn problem
+        start = time.time()
+        mesh.solveSn(False, 1)
+        timings['vacuum'] = time.time() - start
+
+        # solve the reflective boundary Sn problem
+        start = time.time()
+        with contextlib.closing(mesh.iterate(True, case['num_iter'])) as iterations:
+            stopped = watchSolve(iterations, **case['stop'])
+        timings['reflective'] = time.time() - start
+
+        mesh.close()
+
+    return caseResults(mesh, timings, stopped)
+
+
+# run the iterations of a reflective solve (see Mesh.iterate) until it
+# ends or eps shows it is not converging: eps has not reached a new low for
+# stall_iterations iterations ('stalled') or has grown to divergence times
+# its lowest value ('diverged'). Returns why the solve was stopped, or None.
+def watchSolve(iterations, stall_iterations=None, divergence=None):
+
+    lowest = None
+    since_lowest = 0
+    for state in iterations:
+        if lowest is None or state.eps < lowest:
+            lowest = state.eps
+            since_lowest = 0
+        else:
+            since_lowest += 1
+
+        if state.converged:
+            break
+        if divergence is not None and state.eps > divergence * lowest:
+            return 'diverged'
+        if stall_iterations is not None and since_lowest >= stall_iterations:
+            return 'stalled'
+
+    return None
+
+
+# check whether a case can be solved in a batch (see batch.VariantBatch):
+# cases with stopping rules are watched one at a time, and a batch sweeps
+# the whole mesh with the angular fluxes stored and supports Anderson
+# acceleration only
+def batchable(case):
+
+    options = case['options']
+    stopping = any(value is not None for value in case['stop'].values())
+    if stopping or options.get('symmetry') is not None or options.get('low_memory'):
+        return False
+
+    return options.get('acceleration', 'auto') in ACCELERATIONS
+
+
+# get the key of the cases that can be solved in one batch: the same
+# order, mesh width, iteration count and solver options
+def batchKey(case):
+
+    width = int(case['pitch']//case['mesh_size'])
+
+    return json.dumps([case['order'], width, case['num_iter'], case['options']], sort_keys=True)
+
+
+# run cases together as one batch (see batch.VariantBatch) and return the
+# results of each; the timings are those of the whole batch
+def runBatch(cases, verbose=False):
+
+    timings = {}
+    output = io.StringIO()
+    redirect = contextlib.redirect_stdout(output) if not verbose else contextlib.nullcontext()
+
+    with redirect:
+        start = time.time()
+        meshes = [makeMesh(case) for case in cases]
+        variants = VariantBatch(meshes)
+        timings['setup'] = time.time() - start
+
+        start = time.time()
+        variants.solveSn(False)
+        timings['vacuum'] = time.time() - start
+
+        start = time.time()
+        variants.solveSn(True, cases[0]['num_iter'])
+        timings['reflective'] = time.time() - start
+
+    timings['batch_size'] = len(cases)
+
+    return [caseResults(mesh, dict(timings)) for mesh in meshes]
+
+
+class ResultCache(object):
+
+    # results stored as JSON files named by case key under cache_dir
+    def __init__(self, cache_dir):
+
+        self.cache_dir = cache_dir
+
+    def path(self, key):
+
+        return os.path.join(self.cache_dir, key[:2], key + '.json')
+
+    # get the cached results of a case, or None
+    def get(self, case):
+
+        path = self.path(caseKey(case))
+        if not os.path.exists(path):
+            return None
+
+        with open(path) as cache_file:
+            return json.load(cache_file)['results']
+
+    # store the results of a case
+    def put(self, case, results):
+
+        path = self.path(caseKey(case))
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        # write to a temporary file and rename so readers never see a
+        # partially written result
+        tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_path, 'w') as cache_file:
+            json.dump({'case': case, 'results': results}, cache_file, sort_keys=True, indent=1)
+        os.replace(tmp_path, path)
+
+
+# run a list of (index, case) in a pool worker, as one batch if there is
+# more than one
+def _runCases(todo):
+
+    indices = [index for index, case in todo]
+    cases = [case for index, case in todo]
+    if len(cases) == 1:
+        return [(indices[0], runCase(cases[0]))]
+
+    return list(zip(indices, runBatch(cases)))
+
+
+# run the cases that are not in the cache on a pool of num_workers
+# processes (all cores by default; 1 runs them in this process) and return
+# the results of every case in order. With batch_size above one, cases
+# with the same batchKey are solved together in batches of up to
+# batch_size; the rest (see batchable) are run one at a time.
+def runCampaign(cases, cache_dir='discord_cache', num_workers=None, verbose=True, batch_size=1):
+
+    cache = ResultCache(cache_dir) if cache_dir is not None else None
+    results = [None] * len(cases)
+    todo = []
+
+    for index, case in enumerate(cases):
+        if cache is not None:
+            results[index] = cache.get(case)
+        if results[index] is None:
+            todo.append((index, case))
+
+    if verbose:
+        print('campaign: {} cases, {} cached, {} to run'.format(len(cases), len(cases) - len(todo), len(todo)))
+
+    # group the cases to run into batches
+    batch_size = max(batch_size, 1)
+    groups = {}
+    for index, case in todo:
+        batched = batch_size > 1 and batchable(case)
+        groups.setdefault(batchKey(case) if batched else index, []).append((index, case))
+    batches = [group[start:start + batch_size] for group in groups.values()
+               for start in range(0, len(group), batch_size)]
+
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count()
+    num_workers = max(1, min(num_workers, len(batches)))
+
+    if num_workers == 1:
+        finished = map(_runCases, batches)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(num_workers)
+        finished = pool.imap_unordered(_runCases, batches)
+
+    try:
+        for index, case_results in itertools.chain.from_iterable(finished):
+            results[index] = case_results
+            if cache is not None:
+                cache.put(cases[index], case_results)
+            if verbose:
+                case = cases[index]
+                print('campaign: order {} mesh_size {} pitch {} fuel_diameter {} geometry {} dancoff {:.6f}'.format(
+                    case['order'], case['mesh_size'], case['pitch'], case['fuel_diameter'], case['geometry'],
+                    case_results['dancoff']))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    return results
@@ -1,13 +1,115 @@
 import numpy as np
 
 class Cell(object):
-    
-    def __init__(self, num_angles, id):
-        self.ang_flux = np.zeros(num_angles)
-        self.flux     = 0.0
-        self.old_flux = 0.0
-        self.id       = id
+
+    # a cell created with a mesh is a view onto the mesh's flux and material
+    # arrays; a cell created without one keeps its own storage. On a
+    # multigroup mesh the fluxes of a cell are arrays over the groups. A
+    # low-memory mesh only has the angular fluxes of its probe cells.
+    def __init__(self, num_angles, id, mesh=None, dtype=float):
+
+        self.id   = id
+        self.mesh = mesh
+
+        if mesh is None:
+            self._ang_flux = np.zeros(num_angles, dtype=dtype)
+            self._flux     = 0.0
+            self._old_flux = 0.0
+            self._material = None
+        else:
+            self.y, self.x = divmod(id, mesh.width)
 
     def setMaterial(self, material):
-    
+
         self.material = material
+
+    @property
+    def ang_flux(self):
+
+        if self.mesh is None:
+            return self._ang_flux
+        if self.mesh.low_memory:
+            return self.mesh.probeAngularFlux(self.y, self.x)
+        return self.mesh.cell_ang_flux[self.y, self.x]
+
+    @ang_flux.setter
+    def ang_flux(self, ang_flux):
+
+        if self.mesh is None:
+            self._ang_flux = ang_flux
+        elif self.mesh.low_memory:
+            raise ValueError('the angular fluxes of a low-memory mesh are set by the sweeps')
+        else:
+            self.mesh.cell_ang_flux[self.y, self.x] = ang_flux
+
+    @property
+    def flux(self):
+
+        if self.mesh is None:
+            return self._flux
+        return self.mesh.flux[self.y, self.x]
+
+    @flux.setter
+    def flux(self, flux):
+
+        if self.mesh is None:
+            self._flux = flux
+        else:
+            self.mesh.flux[self.y, self.x] = flux
+
+    @property
+    def old_flux(self):
+
+        if self.mesh is None:
+            return self._old_flux
+        return self.mesh.old_flux[self.y, self.x]
+
+    @old_flux.setter
+    def old_flux(self, old_flux):
+
+        if self.mesh is None:
+            self._old_flux = old_flux
+        else:
+            self.mesh.old_flux[self.y, self.x] = old_flux
+
+    @property
+    def material(self):
+
+        if self.mesh is None:
+            return self._material
+        return self.mesh.materials[self.mesh.material_map[self.y, self.x]]
+
+    @material.setter
+    def material(self, material):
+
+        if self.mesh is None:
+            self._material = material
+        else:
+            self.mesh.material_map[self.y, self.x] = self.mesh.materialIndex(material)
+
+
+class CellArray(object):
+
+    # a sequence of cell views onto a mesh, indexed like the flattened mesh
+    # (cell id = y*width + x)
+    def __init__(self, mesh):
+
+        self.mesh = mesh
+
+    def __len__(self):
+
+        return self.mesh.width**2
+
+    def __getitem__(self, id):
+
+        if id < 0:
+            id += len(self)
+        if id < 0 or id >= len(self):
+            raise IndexError('cell id ' + str(id) + ' out of range')
+
+        return Cell(self.mesh.num_angles, int(id), self.mesh)
+
+    def __iter__(self):
+
+        for id in range(len(self)):
+            yield self[id]
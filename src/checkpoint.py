@@ -0,0 +1,110 @@
+import numpy as np
+import glob
+import json
+import os
+
+# Checkpoint/restart of the Sn solver state.
+#
+# A checkpoint is a directory holding one .npy file per solver array and a
+# state.json describing the run. The arrays are written through memory
+# maps, so large angular flux arrays stream to disk without an extra copy,
+# and are read back the same way. Every checkpoint writes a new
+# generation of array files and then atomically replaces state.json, so a
+# run killed while checkpointing leaves the previous checkpoint intact.
+
+# the mesh arrays saved in a checkpoint (those the mesh has; a low-memory
+# mesh has no cell angular fluxes)
+CHECKPOINT_ARRAYS = ['ang_flux', 'cell_ang_flux', 'flux', 'old_flux', 'scalar_flux']
+
+
+# path of an array file of some checkpoint generation
+def arrayPath(path, name, generation):
+
+    return os.path.join(path, '{}.{}.npy'.format(name, generation))
+
+
+# read the state.json of a checkpoint, or None if there is none
+def readState(path):
+
+    state_path = os.path.join(path, 'state.json')
+    if not os.path.exists(state_path):
+        return None
+
+    with open(state_path) as state_file:
+        return json.load(state_file)
+
+
+# save the mesh solver state with the given run information (iteration,
+# eps, ...) to a checkpoint directory
+def saveCheckpoint(mesh, path, **info):
+
+    if not os.path.isdir(path):
+        os.makedirs(path, exist_ok=True)
+
+    previous = readState(path)
+    generation = 0 if previous is None else previous['generation'] + 1
+
+    # write the arrays of the new generation through memory maps
+    names = [name for name in CHECKPOINT_ARRAYS if getattr(mesh, name) is not None]
+    for name in names:
+        array = getattr(mesh, name)
+        saved = np.lib.format.open_memmap(arrayPath(path, name, generation), mode='w+',
+                                          dtype=array.dtype, shape=array.shape)
+        saved[...] = array
+        saved.flush()
+        del saved
+
+    state = {}
+    state['generation'] = generation
+    state['arrays'] = names
+    state['width'] = mesh.width
+    state['order'] = mesh.order
+    state['mesh_size'] = mesh.mesh_size
+    state['num_angles'] = mesh.num_angles
+    state['x_widths'] = mesh.x_widths.tolist()
+    state['y_widths'] = mesh.y_widths.tolist()
+    for key, value in info.items():
+        state[key] = value.tolist() if isinstance(value, (np.generic, np.ndarray)) else value
+
+    # switch to the new generation, then remove the old array files
+    tmp_path = os.path.join(path, 'state.json.tmp')
+    with open(tmp_path, 'w') as state_file:
+        json.dump(state, state_file, sort_keys=True, indent=1)
+    os.replace(tmp_path, os.path.join(path, 'state.json'))
+
+    for name in CHECKPOINT_ARRAYS:
+        for old_path in glob.glob(os.path.join(path, name + '.*.npy')):
+            if old_path != arrayPath(path, name, generation):
+                os.remove(old_path)
+
+    return state
+
+
+# load a checkpoint into the mesh arrays and return its state
+def loadCheckpoint(mesh, path):
+
+    state = readState(path)
+    if state is None:
+        raise IOError('no checkpoint in ' + str(path))
+
+    for key in ('width', 'order', 'mesh_size', 'num_angles'):
+        if state[key] != getattr(mesh, key):
+            raise ValueError('checkpoint {} {} does not match mesh {} {}'.format(
+                key, state[key], key, getattr(mesh, key)))
+
+    for key in ('x_widths', 'y_widths'):
+        if not np.array_equal(state[key], getattr(mesh, key)):
+            raise ValueError('checkpoint ' + key + ' do not match the mesh')
+
+    # (the cell angular fluxes are only needed by a mesh that stores them)
+    for name in state['arrays']:
+        if getattr(mesh, name) is None:
+            continue
+        saved = np.load(arrayPath(path, name, state['generation']), mmap_mode='r')
+        array = getattr(mesh, name)
+        if array.shape != saved.shape:
+            raise ValueError('checkpoint array ' + name + ' has the wrong shape')
+        array[...] = saved
+        del saved
+
+    return state
@@ -0,0 +1,160 @@
+import numpy as np
+
+# Diffusion synthetic acceleration (DSA) of the scattering source iteration.
+#
+# A sweep with the scattering source of the previous scalar flux phi_old
+# gives a new scalar flux phi_new. Its error is close to the solution f of
+# the diffusion equation
+#
+#   -div D grad f + sigma_a f = sigma_s (phi_new - phi_old)
+#
+# with D = 1 / (3 sigma_t) and sigma_a = sigma_t - sigma_s (sigma_s being
+# the within-group scattering cross section). Plain source iteration damps
+# the smooth error modes by a factor of only about sigma_s / sigma_t per
+# sweep; adding f to phi_new removes them, so the iteration count stays
+# bounded as the scattering ratio goes to 1.
+#
+# The equation is discretized with bilinear finite elements on the cell
+# corners and a lumped mass matrix, and the cell correction is the average
+# of the corner values. Cells are squares of one size or, on a graded mesh,
+# rectangles. Unlike a cell centred finite difference scheme this
+# stays stable with the diamond difference sweeps on optically thick cells.
+# It is solved by conjugate gradients with a diagonal preconditioner. Cell
+# arrays are indexed [y, x, ...] and corner arrays [y, x, ...] on the
+# (width + 1) x (width + 1) corners; the trailing axes (energy groups) are
+# independent problems solved together.
+
+
+# get the average of the corner values of each cell
+def cellAverage(corners):
+
+    return (corners[:-1, :-1] + corners[:-1, 1:] + corners[1:, 1:] + corners[1:, :-1]) / 4.0
+
+
+# spread a value of each cell equally over its four corners
+def spreadToCorners(cells):
+
+    corners = np.zeros((cells.shape[0] + 1, cells.shape[1] + 1) + cells.shape[2:])
+    corners[:-1, :-1] += cells / 4.0
+    corners[:-1, 1:] += cells / 4.0
+    corners[1:, 1:] += cells / 4.0
+    corners[1:, :-1] += cells / 4.0
+
+    return corners
+
+
+class DiffusionOperator(object):
+
+    # sigma_t      total cross section of each cell
+    # sigma_a      removal cross section of each cell
+    # mesh_size    cell width, or the (y_widths, x_widths) cell widths of a
+    #              graded mesh
+    # boundary     'reflective' (zero current) or 'vacuum' (Marshak)
+    #              boundary conditions on all four sides
+    def __init__(self, sigma_t, sigma_a, mesh_size, boundary='reflective'):
+
+        if boundary not in ('reflective', 'vacuum'):
+            raise ValueError('unknown boundary condition ' + str(boundary))
+
+        sigma_t = np.asarray(sigma_t, dtype=float)
+        self.mesh_size = mesh_size
+        self.boundary = boundary
+
+        # cell widths that broadcast against the cell arrays
+        if np.ndim(mesh_size) == 0:
+            y_faces = x_faces = np.full(sigma_t.shape[0], float(mesh_size))
+            h_y = h_x = mesh_size
+        else:
+            y_faces, x_faces = (np.asarray(widths, dtype=float) for widths in mesh_size)
+            batch = (1,) * (sigma_t.ndim - 2)
+            h_y = y_faces.reshape((-1, 1) + batch)
+            h_x = x_faces.reshape((1, -1) + batch)
+        self.area = h_x * h_y
+
+        # the bilinear stiffness matrix of a h_x by h_y cell is D / 6 times
+        # h_y / h_x (2 on the diagonal, -2 between corners across the cell
+        # in x, 1 between corners across it in y and -1 between opposite
+        # corners) plus the same in y. For a square cell this is 4 on the
+        # diagonal, -1 between adjacent corners and -2 between opposite
+        # corners, whatever the cell size.
+        stiffness = 1.0 / (18.0 * sigma_t)
+        k_x = stiffness * (h_y / h_x)
+        k_y = stiffness * (h_x / h_y)
+        self.across_x = 2.0 * k_x - k_y
+        self.across_y = 2.0 * k_y - k_x
+        self.opposite = k_x + k_y
+
+        self.diagonal = spreadToCorners(8.0 * self.opposite + np.asarray(sigma_a, dtype=float) * self.area)
+
+        # leakage through a vacuum boundary face (the Marshak condition
+        # J = f / 2), lumped onto the corners: each corner on the boundary
+        # gets half the length of each boundary face it ends, times 1 / 2.
+        # The faces are padded with zero lengths so a corner of the mesh
+        # only gets its one face on each side.
+        if boundary == 'vacuum':
+            batch = (1,) * (sigma_t.ndim - 2)
+            y_faces = np.concatenate([[0.0], y_faces, [0.0]])
+            x_faces = np.concatenate([[0.0], x_faces, [0.0]])
+            y_leak = ((y_faces[:-1] + y_faces[1:]) / 4.0).reshape((-1,) + batch)
+            x_leak = ((x_faces[:-1] + x_faces[1:]) / 4.0).reshape((-1,) + batch)
+            self.diagonal[0] += x_leak
+            self.diagonal[-1] += x_leak
+            self.diagonal[:, 0] += y_leak
+            self.diagonal[:, -1] += y_leak
+
+    # apply the diffusion operator to the corner values f
+    def apply(self, f):
+
+        across_x = self.across_x
+        across_y = self.across_y
+        opposite = self.opposite
+        bottom_left = f[:-1, :-1]
+        bottom_right = f[:-1, 1:]
+        top_right = f[1:, 1:]
+        top_left = f[1:, :-1]
+
+        result = self.diagonal * f
+        result[:-1, :-1] -= across_x * bottom_right + across_y * top_left + opposite * top_right
+        result[:-1, 1:] -= across_x * bottom_left + across_y * top_right + opposite * top_left
+        result[1:, 1:] -= across_x * top_left + across_y * bottom_right + opposite * bottom_left
+        result[1:, :-1] -= across_x * top_right + across_y * bottom_left + opposite * bottom_right
+
+        return result
+
+    # solve the diffusion equation for the source of each cell to the given
+    # relative residual and return the corner values and the number of
+    # conjugate gradient iterations
+    def solve(self, source, tolerance=1e-6, max_iterations=None):
+
+        rhs = spreadToCorners(source * self.area)
+        if max_iterations is None:
+            max_iterations = 10 * (rhs.shape[0] + rhs.shape[1])
+
+        f = np.zeros_like(rhs)
+        residual = rhs
+        z = residual / self.diagonal
+        direction = z.copy()
+        rz = np.sum(residual * z, axis=(0, 1))
+        target = tolerance * np.sqrt(np.sum(residual**2, axis=(0, 1)))
+
+        iteration = 0
+        while iteration < max_iterations:
+            if np.all(np.sqrt(np.sum(residual**2, axis=(0, 1))) <= target):
+                break
+
+            a_direction = self.apply(direction)
+            curvature = np.sum(direction * a_direction, axis=(0, 1))
+
+            # groups that are already solved get zero steps
+            alpha = np.divide(rz, curvature, out=np.zeros_like(rz), where=curvature > 0)
+            f += alpha * direction
+            residual -= alpha * a_direction
+
+            z = residual / self.diagonal
+            rz_new = np.sum(residual * z, axis=(0, 1))
+            beta = np.divide(rz_new, rz, out=np.zeros_like(rz), where=rz > 0)
+            direction = z + beta * direction
+            rz = rz_new
+            iteration += 1
+
+        return f, iteration
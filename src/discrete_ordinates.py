@@ -1,6 +1,14 @@
 import numpy as np
 import matplotlib.pyplot as plt
 import quadrature
+import sweeper
+import geometry as geom
+import parallel
+import acceleration
+import checkpoint
+import diffusion
+import response
+import instrumentation
 from math import *
 from cell import *
 from material import *
@@ -10,367 +18,1167 @@ import sys
 import getopt
 import time
 
+# The four quadrants in the order they are swept. Each entry holds the
+# x and y sweep directions, the edge buffer and angle offset (in units of
+# num_angles//4) used for the x and y edge fluxes, and the block of cell
+# angular fluxes the quadrant fills.
+QUADRANTS = [( 1,  1, 0, 0, 1, 0, 0),  # positive mu and eta (bottom left corner)
+             (-1, -1, 2, 1, 3, 1, 2),  # negative mu and eta (top right corner)
+             (-1,  1, 2, 0, 1, 1, 1),  # negative mu and positive eta (bottom right corner)
+             ( 1, -1, 0, 1, 3, 0, 3)]  # positive mu and negative eta (top left corner)
+
+# the timer names of the quadrant sweeps, in the order of QUADRANTS
+SWEEP_PHASES = ['sweep.q0', 'sweep.q1', 'sweep.q2', 'sweep.q3']
+
+# the order the quadrants (indices into QUADRANTS) are swept in on a
+# symmetry-reduced domain: every quadrant leaving the domain through a
+# symmetry plane is swept before the quadrant it reflects into, so one pass
+# solves the vacuum boundary problem
+SYMMETRY_ORDER = [1, 2, 3, 0]
+
+# the quadrant blocks of the cell angular fluxes mirrored in x and in y
+MIRROR_X = [1, 0, 3, 2]
+MIRROR_Y = [3, 2, 1, 0]
+
+
+# the state of the Sn solve after one iteration (see Mesh.iterate): the
+# iteration number, whether it was a reflective iteration (update), eps,
+# whether the solve has converged and the scalar flux of the mesh, which
+# is not copied and is replaced by the next iteration
+class SnIteration(object):
+
+    def __init__(self, iteration, update, eps, converged, scalar_flux):
+
+        self.iteration   = iteration
+        self.update      = update
+        self.eps         = eps
+        self.converged   = converged
+        self.scalar_flux = scalar_flux
+
+
 class Mesh(object):
 
-    def __init__(self, mesh_size, order, tolerance, pitch=1.26, fuel_diameter=0.70, geometry='square'):
+    def __init__(self, mesh_size, order, tolerance, pitch=1.26, fuel_diameter=0.70, geometry='square', sweep='wavefront',
+                 num_workers=1, parallel='angle', plot_policy='every', plot_every=1, plot_queue_size=4,
+                 acceleration='auto', anderson_depth=5, checkpoint_path=None, checkpoint_every=0, num_groups=1,
+                 dsa=True, max_source_iterations=1000, instrument=False, verbose=True, symmetry=None,
+                 x_widths=None, y_widths=None, low_memory=False, probe_cells=None, dtype=np.float64):
+
+        # the angular fluxes, cell sources, quadrature and sweep coefficients
+        # are stored in dtype (float32 halves the memory traffic of the
+        # sweeps); the scalar fluxes and tallies are always float64
+        self.dtype         = np.dtype(dtype)
 
         # initialize variables and create lists for storing values
         self.width         = int(pitch//mesh_size)
-        self.quad          = quadrature.LevelSymmetricQuadrature().getQuadrature(order)
+        self.quad          = quadrature.getQuadrature(order, self.dtype)
         self.fuel_diameter = fuel_diameter
         self.mesh_size     = mesh_size
         self.order         = order
         self.tol           = tolerance
         self.num_angles    = self.quad['num_angles']
         self.pitch         = pitch
-        self.cells         = np.empty(self.width**2, dtype=object)
-        self.ang_flux      = np.zeros((4,self.width,self.num_angles//2))
+        self.num_groups    = num_groups
+
+        # the mesh is uniform with square cells of side mesh_size, or graded
+        # with the given cell widths across the pitch in x and y (see
+        # geometry.gradedWidths); mesh_size then only labels the plots
+        self.graded = x_widths is not None or y_widths is not None
+        if self.graded:
+            x_widths = np.asarray(x_widths if x_widths is not None else y_widths, dtype=float)
+            y_widths = np.asarray(y_widths if y_widths is not None else x_widths, dtype=float)
+            if len(x_widths) != len(y_widths):
+                raise ValueError('the mesh needs as many cells in x as in y')
+            if not (np.isclose(np.sum(x_widths), pitch) and np.isclose(np.sum(y_widths), pitch)):
+                raise ValueError('the cell widths do not add up to the pitch')
+            self.width = len(x_widths)
+        else:
+            x_widths = y_widths = np.full(self.width, float(mesh_size))
+        self.x_widths = x_widths
+        self.y_widths = y_widths
+
+        # the area of each cell, shaped to multiply the cell arrays
+        if self.graded:
+            self.cell_area = (y_widths[:, np.newaxis] * x_widths).reshape(
+                (self.width, self.width) + (1,) * len(self.batchShape()))
+        else:
+            self.cell_area = self.mesh_size**2
+
+        self.ang_flux      = np.zeros((4,self.width) + self.batchShape() + (self.num_angles//2,), dtype=self.dtype)
         self.geometry      = geometry
-
-        # create the mesh cells
-        for y in range(self.width):
-            for x in range(self.width):
-                self.cells[y*self.width+x] = Cell(self.num_angles, y*self.width+x)
-
+        self.sweep         = sweep
+        self.num_workers   = num_workers
+        self.parallel      = parallel
+        self.pool          = None
+        self.coefficients  = None
+        self.tallies       = None
+
+        # scalar flux images are written by a background writer, either
+        # every plot_every iterations ('every'), for the last iteration of
+        # each solve only ('final') or not at all ('none')
+        self.plot_policy     = plot_policy
+        self.plot_every      = plot_every
+        self.plot_queue_size = plot_queue_size
+
+        # the reflective boundary iteration is plain fixed-point iteration
+        # (None), Anderson mixing of the boundary fluxes ('anderson') or a
+        # jump to the fixed point with the boundary response matrix
+        # ('response', see response), which is kept until the cross
+        # sections, cells or quadrature change. Meshes too large for the
+        # response matrix to pay off use plain iteration instead. 'auto'
+        # mixes graded meshes and iterates uniform ones plainly: in the thin
+        # moderator fluxes streaming along the discrete directions can
+        # circle the fuel for many reflections, and on fine or graded meshes
+        # plain iteration can take thousands of iterations to converge them.
+        if acceleration == 'auto':
+            acceleration = 'anderson' if self.graded else None
+        self.acceleration    = acceleration
+        self.anderson_depth  = anderson_depth
+        self.response        = None
+
+        # within-group scattering is converged by source iteration, with
+        # diffusion synthetic acceleration of the scalar flux if dsa is set;
+        # the vacuum solve stops after max_source_iterations sweeps
+        self.dsa                   = dsa
+        self.max_source_iterations = max_source_iterations
+        self.diffusion             = None
+
+        # reflective solves save a checkpoint to checkpoint_path every
+        # checkpoint_every iterations and when they stop
+        self.checkpoint_path  = checkpoint_path
+        self.checkpoint_every = checkpoint_every
+
+        # the pin cell is symmetric in x and y (and in the diagonal), so
+        # only the upper right quarter of the mesh ('quarter') or the
+        # quarter with one quadrant of angles taken from its diagonal image
+        # ('eighth') needs to be swept; the rest of the cell angular fluxes
+        # are mirrored from it. None sweeps the whole mesh.
+        self.symmetry = symmetry
+
+        # in low-memory mode the cell angular fluxes are not stored: the
+        # sweeps write the weighted angular sum of each quadrant (and each
+        # chunk of its angles swept by a worker) to its own slot of
+        # quadrant_flux, and the full angular fluxes are only kept for the
+        # probe_cells (cell ids, see probeAngularFlux)
+        self.low_memory  = low_memory
+        self.probe_cells = [] if probe_cells is None else [int(id) for id in probe_cells]
+        self.probe_key   = None
+
+        # per-phase timers, work counters and histories of the solver are
+        # kept in stats when instrument is set (see instrumentation), and
+        # progress messages are printed when verbose is set
+        self.stats   = instrumentation.Instrumentation(instrument)
+        self.verbose = verbose
+
+        # cell data is stored as contiguous arrays indexed [y, x], with a
+        # group axis after the cell axes for multigroup problems
+        # ([y, x, group]); the material map indexes into the list of
+        # materials on the mesh
+        cells = (self.width,self.width) + self.batchShape()
+        self.flux          = np.zeros(cells)
+        self.old_flux      = np.zeros(cells)
+        self.scalar_flux   = np.zeros(cells)
+        self.cell_source   = np.zeros(cells, dtype=self.dtype)
+        self.cell_ang_flux = None if low_memory else np.zeros(cells + (self.num_angles,), dtype=self.dtype)
+        self.quadrant_flux = np.zeros(cells + (4,)) if low_memory else None
+        self.probe_map     = None
+        self.probe_ang_flux = None
+        self.material_map  = np.zeros((self.width,self.width), dtype=np.uint8)
+        self.sweep_map     = self.material_map
+        self.materials     = []
+        self.mat_scatter   = None
+        self.mat_sigma_s   = None
+
+        # extra (size, material) regions around the fuel, e.g. gap and clad
+        self.regions       = []
+
+        # the mesh cells are views onto the arrays above
+        self.cells         = CellArray(self)
+
+    # get the batch axes of the flux arrays: none for a one group problem
+    # and the group axis for a multigroup problem
+    def batchShape(self):
+
+        if self.num_groups == 1:
+            return ()
+        return (self.num_groups,)
 
     # set pointer to fuel material
     def setFuel(self, fuel):
 
         self.fuel = fuel
+        self.coefficients = None
 
     # set pointer to moderator material
     def setModerator(self, moderator):
 
         self.moderator = moderator
-
-    # give each cell a pointer to a material
+        self.coefficients = None
+
+    # get the index of a material in the mesh material list, adding it
+    # to the list if it is not there yet
+    def materialIndex(self, material):
+
+        for i, mat in enumerate(self.materials):
+            if mat is material:
+                return i
+
+        if len(self.materials) > np.iinfo(self.material_map.dtype).max:
+            raise ValueError('too many materials for the material map')
+
+        self.materials.append(material)
+        self.updateMaterials()
+
+        return len(self.materials) - 1
+
+    # rebuild the per-material lookup arrays from the material objects; the
+    # group-wise arrays are indexed [material, group] ([material] for one
+    # group) and the scattering matrices [material, from group, to group].
+    # mat_sigma_s holds the within-group scattering cross sections, or is
+    # None if there is no within-group scattering.
+    def updateMaterials(self):
+
+        self.mat_sigma_t = self.groupArray([mat.sigma_t for mat in self.materials], 'sigma_t')
+        self.mat_source  = self.groupArray([mat.source for mat in self.materials], 'source')
+        self.mat_is_fuel = np.array([mat.mat_type == 'fuel' for mat in self.materials], dtype=bool)
+
+        self.mat_scatter = None
+        self.mat_sigma_s = None
+        if any(mat.sigma_s is not None for mat in self.materials):
+            ng = self.num_groups
+            self.mat_scatter = np.zeros((len(self.materials), ng, ng))
+            for i, mat in enumerate(self.materials):
+                if mat.sigma_s is not None:
+                    sigma_s = np.asarray(mat.sigma_s, dtype=float)
+                    if sigma_s.size != ng*ng:
+                        raise ValueError('sigma_s of ' + str(mat.mat_type) + ' is not ' + str(ng) + ' x ' + str(ng))
+                    self.mat_scatter[i] = sigma_s.reshape(ng, ng)
+
+            # the groups are coupled by downscatter only, so the scattering
+            # sources of a group only depend on the group itself and the
+            # groups above it
+            if np.any(np.tril(self.mat_scatter, -1)):
+                raise ValueError('upscatter to higher energy groups is not supported')
+
+            sigma_s = np.diagonal(self.mat_scatter, axis1=1, axis2=2)
+            if np.any(sigma_s):
+                self.mat_sigma_s = sigma_s.reshape(self.mat_sigma_t.shape)
+
+    # stack a group-wise material property into an array indexed
+    # [material, group] ([material] for one group)
+    def groupArray(self, values, name):
+
+        values = [np.asarray(value, dtype=float) for value in values]
+        for value in values:
+            if value.size != self.num_groups:
+                raise ValueError(name + ' has ' + str(value.size) + ' groups, the mesh has ' + str(self.num_groups))
+
+        return np.array(values).reshape((len(values),) + self.batchShape())
+
+    # get the number of source iterations that resolve the downscatter
+    # sources exactly: a chain of n group to group transfers needs n + 1
+    # sweeps
+    def scatterPasses(self):
+
+        if self.mat_scatter is None:
+            return 1
+
+        transfer = np.triu(np.any(self.mat_scatter != 0, axis=0), 1).astype(int)
+        chain = transfer.copy()
+        passes = 1
+        while np.any(chain):
+            chain = np.dot(chain, transfer)
+            passes += 1
+
+        return passes
+
+    # compute the angular source of each cell: the fixed source plus the
+    # isotropic scattering source from the current scalar flux. The scalar
+    # flux is the quadrature sum over the four quadrants, so the source per
+    # steradian sigma_s phi / (4 pi) is sigma_s * scalar_flux / 4.
+    def updateSource(self):
+
+        self.cell_source[...] = self.mat_source[self.material_map]
+
+        if self.mat_scatter is not None:
+            shape = (self.width, self.width, self.num_groups)
+            source = self.cell_source.reshape(shape)
+            flux = self.scalar_flux.reshape(shape)
+            for i, sigma_s in enumerate(self.mat_scatter):
+                if np.any(sigma_s):
+                    cells = self.material_map == i
+                    source[cells] += np.dot(flux[cells], sigma_s) / 4.0
+
+    # add a region (an annulus for the circle geometry) of the given outer
+    # diameter around the fuel, e.g. for gap and clad
+    def addRegion(self, diameter, material):
+
+        self.regions.append((diameter, material))
+        self.coefficients = None
+
+    # fill the material map with the fuel, region and moderator materials
     def makeMeshMaterials(self):
 
-        cw = self.width
-
-        width_to_fuel = cw / 2 - int(self.fuel_diameter / self.mesh_size / 2)
-
-        if self.geometry == 'square':
-            for y in range(cw):
-                for x in range(cw):
-                    if x < width_to_fuel or x >= cw - width_to_fuel:
-                        self.cells[y*cw+x].setMaterial(self.moderator)
-                    else:
-                        if y < width_to_fuel or y >= self.width - width_to_fuel:
-                            self.cells[y*cw+x].setMaterial(self.moderator)
-                        else:
-                            self.cells[y*cw+x].setMaterial(self.fuel)
+        self.coefficients = None
+        moderator = self.materialIndex(self.moderator)
+        regions = [(self.fuel_diameter, self.fuel)] + self.regions
+        regions = [(diameter, self.materialIndex(material)) for diameter, material in regions]
 
-        elif self.geometry == 'circle':
-            for y in range(cw):
-                for x in range(cw):
-                    radius = sqrt((self.pitch/2.0-(y+0.5)*self.mesh_size)**2 + (self.pitch/2.0-(x+0.5)*self.mesh_size)**2)
-
-                    if radius <= self.fuel_diameter/2.0:
-                        self.cells[y*cw+x].setMaterial(self.fuel)
-                    else:
-                        self.cells[y*cw+x].setMaterial(self.moderator)
+        self.material_map = geom.makeMaterialMap(self.geometry, self.width, self.mesh_size, self.pitch,
+                                                 regions, moderator, self.material_map.dtype,
+                                                 (self.y_widths, self.x_widths) if self.graded else None)
 
     # solve the Sn problem
-    def solveSn(self, update, num_iter):
+    #
+    # restart names a checkpoint directory to warm start the reflective
+    # solve from; num_iter more iterations are run from the saved state
+    def solveSn(self, update, num_iter, num_workers=None, restart=None):
+
+        for state in self.iterate(update, num_iter, num_workers, restart):
+            pass
+
+    # get an iterator over the iterations of the Sn solve (see solveSn)
+    # that yields an SnIteration after each one. The caller may stop the
+    # solve at any iteration, which keeps the results of that iteration as
+    # for a solve that ran out of iterations, and may change the tolerance
+    # (tol) between iterations.
+    def iterate(self, update, num_iter, num_workers=None, restart=None):
+
+        # pick up any changes to the material properties
+        self.updateMaterials()
+
+        if num_workers is not None:
+            self.num_workers = num_workers
+        self.checkSymmetry()
+        if self.low_memory:
+            self.makeProbes()
+
+        if self.acceleration not in (None, 'anderson', 'response'):
+            raise ValueError('unknown acceleration ' + str(self.acceleration))
+        if self.acceleration == 'response':
+            if self.mat_scatter is not None or self.symmetry is not None:
+                raise ValueError('response matrix solves need a fixed source, no scattering and no symmetry')
+        jacobi = self.jacobiSweeps()
+        if self.plot_policy not in ('every', 'final', 'none'):
+            raise ValueError('unknown plot policy ' + str(self.plot_policy))
+
+        start = 0
+        if restart is not None:
+            start = self.loadCheckpoint(restart)
+
+        return self.runIterations(update, num_iter, jacobi, start)
+
+    # run the Sn iterations with the scalar flux writer (see iterate). The
+    # solve phase includes the time the caller takes between iterations.
+    def runIterations(self, update, num_iter, jacobi, start):
+
+        writer = None
+        if self.plot_policy != 'none':
+            writer = pttr.ScalarFluxWriter(self.plot_queue_size)
+
+        # closing the writer flushes the images still in its queue
+        try:
+            with self.stats.phase('solve.reflective' if update else 'solve.vacuum'):
+                yield from self.iterateSn(update, num_iter, jacobi, writer, start)
+        except GeneratorExit:
+            pass
+        finally:
+            if writer is not None:
+                writer.close()
+
+        self.stats.emit('solve', {'update': update, 'num_iterations': getattr(self, 'num_iterations', None),
+                                  'converged': getattr(self, 'converged', None)})
+
+    # check whether the four quadrants are swept from the same incoming
+    # fluxes (see sweepAll): on the worker pool in 'quadrant' mode, and for
+    # the response matrix, which is that of such a sweep
+    def jacobiSweeps(self):
+
+        if self.responseSolve():
+            return True
+        return self.num_workers > 1 and self.parallel == 'quadrant' and self.symmetry is None
+
+    # check whether the reflective solve uses the response matrix, which is
+    # only built while it is cheaper than plain iteration (see response)
+    def responseSolve(self):
+
+        return self.acceleration == 'response' and response.useResponse(self.width, self.num_angles//4)
+
+    # check that the material map has the symmetry the solve relies on. The
+    # whole map is checked, so a pin that is off-centre on the mesh (e.g.
+    # one whose cells do not fill the pitch) is rejected rather than solved
+    # as the pin of its swept quarter.
+    def checkSymmetry(self):
+
+        if self.symmetry not in (None, 'quarter', 'eighth'):
+            raise ValueError('unknown symmetry ' + str(self.symmetry))
+
+        material_map = self.material_map
+        if self.symmetry is not None:
+            if not (np.array_equal(material_map, material_map[::-1]) and
+                    np.array_equal(material_map, material_map[:, ::-1])):
+                raise ValueError('the material map is not symmetric in x and y')
+            if not (np.array_equal(self.x_widths, self.x_widths[::-1]) and
+                    np.array_equal(self.y_widths, self.y_widths[::-1])):
+                raise ValueError('the cell widths are not symmetric in x and y')
+        if self.symmetry == 'eighth':
+            if not np.array_equal(material_map, material_map.T):
+                raise ValueError('the material map is not symmetric in the diagonal')
+            if not np.array_equal(self.x_widths, self.y_widths):
+                raise ValueError('the cell widths are not symmetric in the diagonal')
+
+    # print a progress message if the mesh is verbose
+    def log(self, message):
+
+        if self.verbose:
+            print(message)
+
+    # run the Sn iterations, handing scalar flux snapshots to the writer and
+    # yielding an SnIteration after each iteration
+    def iterateSn(self, update, num_iter, jacobi, writer, start=0):
 
-        # create shortened variables for num_angles and width and initialize eps
-        cw = self.width
-        na = self.num_angles
         eps = 1.0
+        self.eps_history = []
+        self.residual_history = []
+        last = start + num_iter - 1
+
+        mixer = None
+        if update and self.acceleration == 'anderson':
+            mixer = acceleration.AndersonMixer(self.anderson_depth)
+        response_matrix = None
+        if update and self.responseSolve():
+            with self.stats.phase('response'):
+                response_matrix = self.responseMatrix()
+        elif update and self.acceleration == 'response':
+            self.log('response matrix too large for this mesh, using plain iteration')
 
         # loop over iterations
-        for iteration in range(num_iter):
-
-            print('Sn iteration ' + str(iteration) + ' eps ' + str(eps))
-
-            ###################################################################
-            # sweep in the positive mu and eta direction (bottom left corner)
-            ###################################################################
-            for y in range(cw):
-                for x in range(cw):
+        for iteration in range(start, start + num_iter):
 
-                    cell = self.cells[y*cw+x]
-                    source = cell.material.source
+            self.log('Sn iteration ' + str(iteration) + ' eps ' + str(eps))
 
-                    for angle in range(na//4):
-
-                        # compute cell centered flux
-                        cell.ang_flux[angle] = (source + 2 * self.quad['mu'][angle]/self.mesh_size * self.ang_flux[0, y, angle] +
-                                                2 * self.quad['eta'][angle]/self.mesh_size * self.ang_flux[1, x, angle]) / \
-                                                (cell.material.sigma_t + 2 * self.quad['mu'][angle]/self.mesh_size + 2 * self.quad['eta'][angle]/self.mesh_size)
-
-                        # sweep from left to right
-                        self.ang_flux[0, y, angle] = 2 * cell.ang_flux[angle] - self.ang_flux[0,y, angle]
-
-                        # sweep from bottom to top
-                        self.ang_flux[1, x, angle] = 2 * cell.ang_flux[angle] - self.ang_flux[1, x, angle]
-
-            # update the boundary angular fluxes
+            state = self.iterationState()
+            previous = self.scalar_flux
             if update:
-                # reflect on right boundary
-                for y in range(cw):
-                    for angle in range(na//4):
-                        self.ang_flux[2, y, angle] = self.ang_flux[0, y, angle]
-
-                # reflect flux on top boundary
-                for x in range(cw):
-                    for angle in range(na//4):
-                        self.ang_flux[3, x, angle] = self.ang_flux[1, x, angle]
-
-
-            ###################################################################
-            # sweep in the negative mu and eta direction (top right corner)
-            ###################################################################
-            for y in reversed(range(cw)):
-                for x in reversed(range(cw)):
-
-                    cell = self.cells[y*cw+x]
-                    source = cell.material.source
-
-                    for angle in range(na//4):
-
-                        # compute cell centered flux
-                        cell.ang_flux[na//2 + angle] = (source + 2 * self.quad['mu'][angle]/self.mesh_size * self.ang_flux[2, y, angle + na//4] +
-                                                        2 * self.quad['eta'][angle]/self.mesh_size * self.ang_flux[3, x, angle + na//4]) / \
-                                                        (cell.material.sigma_t + 2 * self.quad['mu'][angle]/self.mesh_size + 2 * self.quad['eta'][angle]/self.mesh_size)
-
-                        # sweep from right to left
-                        self.ang_flux[2, y, angle + na//4] = 2 * cell.ang_flux[na//2 + angle] - self.ang_flux[2, y, angle + na//4]
-
-                        # sweep from top to bottom
-                        self.ang_flux[3, x, angle + na//4] = 2 * cell.ang_flux[na//2 + angle] - self.ang_flux[3, x, angle + na//4]
+                self.sweepAll(update, jacobi)
+            else:
+                self.sweepVacuum(jacobi)
+
+            # compute the scalar flux and rxn rates in one pass
+            with self.stats.phase('tallies'):
+                tallies = self.computeTallies()
+
+            # accelerate the within-group scattering source iteration
+            if update and self.mat_sigma_s is not None and self.dsa:
+                self.accelerateScattering(previous, 'reflective')
+
+            # mix the boundary fluxes for the next iteration
+            if mixer is not None:
+                with self.stats.phase('mixing'):
+                    self.setIterationState(mixer.update(state, self.iterationState()))
+            else:
+                with self.stats.phase('convergence'):
+                    self.residual_history.append(np.linalg.norm(self.iterationState() - state))
+
+            # jump to the fixed point of the boundary fluxes
+            if response_matrix is not None:
+                with self.stats.phase('response'):
+                    self.ang_flux[...] = response_matrix.update(state, self.ang_flux)
+
+            # if vacuum case, keep the fuel rxn rate and zero out angular flux
+            if update == False:
+                self.RR_isolated = tallies['RR_fuel']
+                self.ang_flux[:] = 0.0
 
-            # update the boundary angular fluxes
+            # compute eps for reflective boundary case
             if update:
-                # reflect on left boundary
-                for y in range(cw):
-                    for angle in range(na//4):
-                        self.ang_flux[0, y, angle + na//4] = self.ang_flux[2, y, angle + na//4]
-
-                # reflect flux on bottom boundary
-                for x in range(cw):
-                    for angle in range(na//4):
-                        self.ang_flux[1, x, angle + na//4] = self.ang_flux[3, x, angle + na//4]
-
-
-
-            # sweep in the negative mu and positive eta direction (bottom right corner)
-            for y in range(cw):
-                for x in reversed(range(cw)):
-
-                    cell = self.cells[y*cw+x]
-                    source = cell.material.source
-
-                    for angle in range(na//4):
-
-                        # compute cell centered flux
-                        cell.ang_flux[na//4 + angle] = (source + 2 * self.quad['mu'][angle]/self.mesh_size * self.ang_flux[2, y, angle] +
-                                                        2 * self.quad['eta'][angle]/self.mesh_size * self.ang_flux[1, x, angle + na//4]) / \
-                                                        (cell.material.sigma_t + 2 * self.quad['mu'][angle]/self.mesh_size + 2 * self.quad['eta'][angle]/self.mesh_size)
-
-                        # sweep from right to left
-                        self.ang_flux[2, y, angle] = 2 * cell.ang_flux[na//4 + angle] - self.ang_flux[2, y, angle]
+                eps = tallies['eps']
+                self.eps_history.append(eps)
+                self.stats.append('eps', eps)
+
+            # (the first Jacobi or symmetry-reduced iteration repeats the
+            # vacuum sweep, so it is skipped)
+            converged = update and eps < self.tol and (iteration > 0 or not (jacobi or self.symmetry))
+            self.stats.count('iterations')
+            self.stats.emit('iteration', {'iteration': iteration, 'update': update, 'eps': eps,
+                                          'converged': converged})
+            final = converged or iteration == last
+
+            # plot the scalar flux; vacuum boundary images are numbered from 100
+            if writer is not None:
+                if final or (self.plot_policy == 'every' and iteration % self.plot_every == 0):
+                    with self.stats.phase('plot'):
+                        writer.submit(self.totalFlux(), self.order, self.mesh_size, iteration + 100*(not update),
+                                      self.plotWidths())
+
+            # save a checkpoint every checkpoint_every iterations and when stopping
+            if update and self.checkpoint_path is not None:
+                if final or (self.checkpoint_every and (iteration + 1) % self.checkpoint_every == 0):
+                    with self.stats.phase('checkpoint'):
+                        self.saveCheckpoint(self.checkpoint_path, iteration, eps)
+
+            # if converged (or out of iterations) compute the Dancoff factor
+            # and flux ratio
+            if update and final:
+                self.finishReflective(tallies, eps, converged, iteration, mixer)
+
+            # a reflective solve the caller stops ends at this iteration
+            try:
+                yield SnIteration(iteration, update, eps, converged, self.scalar_flux)
+            except GeneratorExit:
+                if update and not final:
+                    if self.checkpoint_path is not None:
+                        with self.stats.phase('checkpoint'):
+                            self.saveCheckpoint(self.checkpoint_path, iteration, eps)
+                    self.finishReflective(tallies, eps, converged, iteration, mixer)
+                raise
+
+            if update and final:
+                break
 
-                        # sweep from bottom to top
-                        self.ang_flux[1, x, angle + na//4] = 2 * cell.ang_flux[na//4 + angle] - self.ang_flux[1, x, angle + na//4]
+    # keep the results of the last iteration of a reflective solve (the
+    # tallies, the Dancoff factor and the convergence state) and report them
+    def finishReflective(self, tallies, eps, converged, iteration, mixer=None):
+
+        self.converged = converged
+        self.num_iterations = iteration + 1
+        if mixer is not None:
+            self.residual_history = mixer.residual_history
+            self.accelerated = mixer.active
+        self.RR_lattice = tallies['RR_fuel']
+        self.RR_total = tallies['RR_total']
+        self.flux_ratio = tallies['flux_ratio']
+        self.dancoff = 1 - (1.0 - self.RR_lattice / self.RR_total) / (1.0 - self.RR_isolated / self.RR_total)
+        self.dancoff2 = 1 - (1.0 / np.asarray(self.fuel.sigma_t, dtype=float))
+        if converged:
+            self.log('EPS converged ' + str(eps))
+        else:
+            self.log('EPS not converged after ' + str(iteration + 1) + ' iterations ' + str(eps))
+        if mixer is not None and not mixer.active:
+            self.log('Anderson acceleration fell back to plain iteration')
+        self.log('RR isolated ' + str(self.RR_isolated))
+        self.log('RR lattice ' + str(self.RR_lattice))
+        self.log('flux ratio ' + str(self.flux_ratio))
+        self.log('Dancoff factor ' + str(self.dancoff))
+
+    # save the reflective solver state after the given iteration
+    def saveCheckpoint(self, path, iteration, eps):
+
+        checkpoint.saveCheckpoint(self, path, iteration=iteration, eps=eps,
+                                  RR_isolated=getattr(self, 'RR_isolated', None))
+
+    # load the reflective solver state and get the iteration to continue from
+    def loadCheckpoint(self, path):
+
+        state = checkpoint.loadCheckpoint(self, path)
+        self.tallies = None
+
+        if state.get('RR_isolated') is not None:
+            self.RR_isolated = state['RR_isolated']
+            if isinstance(self.RR_isolated, list):
+                self.RR_isolated = np.array(self.RR_isolated)
+
+        return state['iteration'] + 1
+
+    # get the state carried from one iteration to the next: the boundary
+    # angular fluxes and, when the groups are coupled by scattering, the
+    # scalar flux that sets the scattering sources
+    def iterationState(self):
+
+        if self.mat_scatter is None:
+            return self.ang_flux.copy()
+        return np.concatenate((self.ang_flux.ravel(), self.scalar_flux.ravel()))
+
+    # set the state for the next iteration (see iterationState)
+    def setIterationState(self, state):
+
+        state = np.asarray(state).ravel()
+        self.ang_flux[...] = state[:self.ang_flux.size].reshape(self.ang_flux.shape)
+        if self.mat_scatter is not None:
+            self.scalar_flux[...] = state[self.ang_flux.size:].reshape(self.scalar_flux.shape)
+
+    # sweep the vacuum boundary problem, repeating the sweep until the
+    # downscatter sources are resolved and, with within-group scattering,
+    # the scalar flux is converged
+    def sweepVacuum(self, jacobi=False):
+
+        passes = self.scatterPasses()
+        if self.mat_sigma_s is not None:
+            passes = max(passes, self.max_source_iterations)
+        self.source_iterations = 0
+
+        for sweep in range(passes):
+            previous = self.scalar_flux
+            self.ang_flux[...] = 0.0
+            self.sweepAll(False, jacobi)
+            self.scalar_flux = self.integrateFlux()
+            self.source_iterations += 1
+            self.stats.count('source_iterations')
+
+            if self.mat_sigma_s is not None:
+                with self.stats.phase('convergence'):
+                    change = self.fluxChange(previous)
+                if self.dsa:
+                    self.accelerateScattering(previous, 'vacuum')
+                if change < self.tol and sweep + 1 >= self.scatterPasses():
+                    break
+        else:
+            if self.mat_sigma_s is not None:
+                self.log('source iteration not converged after ' + str(passes) + ' sweeps ' + str(change))
+
+    # get the L2 norm of the change in the scalar flux, normalized to a
+    # mean of one in each group as for eps
+    def fluxChange(self, previous):
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return sqrt(np.sum(((self.scalar_flux - previous) / self.averageFlux(self.scalar_flux))**2))
+
+    # add the diffusion estimate of the error of the scalar flux after a
+    # source iteration from the previous scalar flux (see diffusion). With
+    # reflective boundaries the incoming boundary angular fluxes get the
+    # matching isotropic correction, a quarter of the scalar flux correction
+    # on the boundary face as the quadrature weights sum to 4.
+    def accelerateScattering(self, previous, boundary):
+
+        with self.stats.phase('dsa'):
+            sigma_s = self.mat_sigma_s[self.material_map]
+            corners, self.diffusion_iterations = self.diffusionOperator(boundary).solve(sigma_s * (self.scalar_flux - previous))
+            self.scalar_flux = self.scalar_flux + diffusion.cellAverage(corners)
+
+            if boundary == 'reflective':
+                self.ang_flux[0] += (corners[:-1, 0] + corners[1:, 0])[..., np.newaxis] / 8.0
+                self.ang_flux[2] += (corners[:-1, -1] + corners[1:, -1])[..., np.newaxis] / 8.0
+                self.ang_flux[1] += (corners[0, :-1] + corners[0, 1:])[..., np.newaxis] / 8.0
+                self.ang_flux[3] += (corners[-1, :-1] + corners[-1, 1:])[..., np.newaxis] / 8.0
+
+        self.stats.count('diffusion_iterations', self.diffusion_iterations)
+
+    # get the diffusion operator of the mesh for the given boundary
+    # conditions, built the first time it is needed and kept until the
+    # materials or the material map change
+    def diffusionOperator(self, boundary):
+
+        key = (boundary, self.mesh_size, self.mat_sigma_t.tobytes(), self.mat_sigma_s.tobytes(),
+               self.material_map.tobytes())
+
+        if self.diffusion is None or self.diffusion[0] != key:
+            sigma_t = self.mat_sigma_t[self.material_map]
+            sigma_a = sigma_t - self.mat_sigma_s[self.material_map]
+            mesh_size = (self.y_widths, self.x_widths) if self.graded else self.mesh_size
+            self.diffusion = (key, diffusion.DiffusionOperator(sigma_t, sigma_a, mesh_size, boundary))
+
+        return self.diffusion[1]
+
+    # get the boundary response matrix of the mesh, building it when the
+    # sweep coefficients change
+    def responseMatrix(self):
+
+        coefficients = self.sweepCoefficients()
+        key = self.coefficients[0]
+
+        if self.response is None or self.response[0] != key:
+            self.response = (key, response.ResponseMatrix(QUADRANTS, self.sweep_map, coefficients,
+                                                          self.batchShape()))
+
+        return self.response[1]
+
+    # sweep all four quadrants once, reflecting the boundary angular fluxes
+    # for the reflective boundary case
+    def sweepAll(self, update, jacobi=False):
+
+        # the scattering sources come from the last scalar flux
+        with self.stats.phase('source'):
+            self.updateSource()
+
+        if self.low_memory:
+            self.resetQuadrantFlux()
+
+        # sweep the quarter of the mesh and mirror it onto the rest
+        if self.symmetry is not None:
+            self.sweepReduced(update)
+            return
+
+        # sweep all four quadrants from the same incoming fluxes, at once
+        # on the worker pool if there is one, then reflect the boundary
+        # angular fluxes (Jacobi update)
+        if jacobi:
+            if self.num_workers > 1:
+                with self.stats.phase('sweep.all'):
+                    self.sweepParallel(QUADRANTS)
+            else:
+                for name, quadrant in zip(SWEEP_PHASES, QUADRANTS):
+                    with self.stats.phase(name):
+                        self.sweepQuadrant(quadrant)
 
-            # update the boundary angular fluxes
             if update:
-                # reflect on left boundary
-                for y in range(cw):
-                    for angle in range(na//4):
-                        self.ang_flux[0, y, angle] = self.ang_flux[2, y, angle]
-
-                # reflect flux on top boundary
-                for x in range(cw):
-                    for angle in range(na//4):
-                        self.ang_flux[3, x, angle + na//4] = self.ang_flux[1, x, angle + na//4]
+                with self.stats.phase('reflect'):
+                    self.reflectAll()
+
+        # sweep the four quadrants, reflecting the outgoing edge fluxes
+        # into the incoming edge fluxes of the mirrored quadrants
+        else:
+            for name, quadrant in zip(SWEEP_PHASES, QUADRANTS):
+                with self.stats.phase(name):
+                    self.sweepQuadrant(quadrant)
+
+                # update the boundary angular fluxes
+                if update:
+                    with self.stats.phase('reflect'):
+                        self.reflectQuadrant(quadrant)
+
+        # every sweep updates each cell once for each angle (and group)
+        self.stats.count('sweeps')
+        self.stats.count('cell_angle_updates', self.flux.size * self.num_angles)
+
+    # sweep the upper right quarter of the mesh in SYMMETRY_ORDER. The
+    # outgoing edge fluxes on the symmetry planes (the left and bottom
+    # edges of the quarter) are always reflected, those on the outer edges
+    # only for the reflective boundary case. On a mesh with an odd width the
+    # symmetry planes cut through the middle row and column of cells, whose
+    # fluxes in the quadrants leaving through the plane are mirror images
+    # of the fluxes in the quadrants entering through it: those quadrants
+    # stop one cell short and reflect the fluxes entering the middle cells.
+    def sweepReduced(self, update):
+
+        updates = 0
+        for index in SYMMETRY_ORDER:
+            quadrant = QUADRANTS[index]
+
+            # the (+mu, -eta) quadrant is the diagonal image of the
+            # (-mu, +eta) quadrant swept before it
+            if self.symmetry == 'eighth' and index == 3:
+                with self.stats.phase('transpose'):
+                    self.transposeQuadrant()
+            else:
+                with self.stats.phase(SWEEP_PHASES[index]):
+                    self.sweepQuadrant(quadrant)
+                y0, x0 = self.domainFirst(quadrant)
+                updates += (self.width - y0) * (self.width - x0) * self.flux[0, 0].size * self.num_angles // 4
+
+            with self.stats.phase('reflect'):
+                self.reflectQuadrant(quadrant, update or quadrant[0] < 0, update or quadrant[1] < 0)
+
+        with self.stats.phase('mirror'):
+            self.mirrorQuarter()
+
+        self.stats.count('sweeps')
+        self.stats.count('cell_angle_updates', updates)
+
+    # get the first (row, column) swept by a quadrant (see sweepReduced)
+    def domainFirst(self, quadrant):
+
+        if self.symmetry is None:
+            return (0, 0)
+
+        half = self.width // 2
+        odd = self.width % 2
+        return (half + odd * (quadrant[1] < 0), half + odd * (quadrant[0] < 0))
+
+    # fill the (+mu, -eta) cell and outgoing edge fluxes of the swept
+    # quarter with the (-mu, +eta) fluxes reflected in the diagonal
+    def transposeQuadrant(self):
+
+        nq = self.num_angles//4
+        half = self.width // 2
+        swap = self.quad['swap']
+        psi, n, cell_swap = self.cellBlocks()
+        quarter = psi[half:, half:]
+
+        quarter[..., 3*n:] = np.swapaxes(quarter[..., n:2*n], 0, 1)[..., cell_swap]
+        self.ang_flux[0, half:, ..., nq:] = self.ang_flux[1, half:, ..., nq:][..., swap]
+        self.ang_flux[3, half:, ..., :nq] = self.ang_flux[2, half:, ..., :nq][..., swap]
+
+    # mirror the cell angular fluxes of the swept quarter onto the rest of
+    # the mesh, swapping the quadrant blocks of the mirrored directions
+    def mirrorQuarter(self):
+
+        half = self.width // 2
+        psi, nq = self.cellBlocks()[:2]
+        mirror_x = np.concatenate([np.arange(block*nq, (block + 1)*nq) for block in MIRROR_X])
+        mirror_y = np.concatenate([np.arange(block*nq, (block + 1)*nq) for block in MIRROR_Y])
+
+        # the middle column (-mu) and row (-eta) of an odd width mesh
+        if self.width % 2:
+            psi[half:, half, ..., nq:3*nq] = psi[half:, half][..., mirror_x[nq:3*nq]]
+            psi[half, half:, ..., 2*nq:] = psi[half, half:][..., mirror_y[2*nq:]]
+
+        psi[half:, :half] = psi[half:, ::-1][:, :half][..., mirror_x]
+        psi[:half] = psi[::-1][:half][..., mirror_y]
+
+    # get the cell array the sweeps fill, its number of columns per quadrant
+    # block and the reflection of the columns of a block in the diagonal:
+    # the cell angular fluxes, or in low-memory mode the quadrant slots,
+    # whose angular sums do not change under the reflection
+    def cellBlocks(self):
+
+        if self.low_memory:
+            slots = self.quadrant_flux.shape[-1]//4
+            return self.quadrant_flux, slots, np.arange(slots)
+        return self.cell_ang_flux, self.num_angles//4, self.quad['swap']
+
+    # get the number of chunks the workers split the angles of a quadrant
+    # into, which is also the number of quadrant_flux slots of each
+    # quadrant in low-memory mode: the workers are shared by the quadrants
+    # swept at once, and a chunk has at least one angle
+    def quadrantSlots(self):
+
+        if self.num_workers <= 1:
+            return 1
+
+        num_quadrants = len(QUADRANTS) if self.jacobiSweeps() else 1
+        return min(-(-self.num_workers // num_quadrants), self.num_angles//4)
+
+    # clear the quadrant slots before a sweep, resizing them if the number
+    # of workers or the sweep order changed
+    def resetQuadrantFlux(self):
+
+        shape = self.flux.shape + (4*self.quadrantSlots(),)
+        if self.quadrant_flux.shape != shape:
+            self.quadrant_flux = np.zeros(shape)
+        else:
+            self.quadrant_flux[...] = 0.0
+
+    # number the cells whose angular fluxes are stored in low-memory mode
+    # and build the probe map of the sweeps. A symmetry-reduced solve
+    # stores the mirror image of each probe cell in the swept quarter (and
+    # for 'eighth' its diagonal image too), see probeAngularFlux.
+    def makeProbes(self):
+
+        key = (tuple(self.probe_cells), self.symmetry)
+        if key == self.probe_key:
+            return
+
+        # the shared probe arrays of a worker pool may change size
+        self.close()
+        self.probe_key = key
+        self.probe_index = {}
+        self.probe_map = None
+        self.probe_ang_flux = None
+        if not self.probe_cells:
+            return
+
+        for id in self.probe_cells:
+            if id < 0 or id >= self.width**2:
+                raise ValueError('probe cell ' + str(id) + ' is not on the mesh')
+            y, x = self.probeImage(*divmod(id, self.width))
+            stored = [(y, x), (x, y)] if self.symmetry == 'eighth' else [(y, x)]
+            for cell in stored:
+                self.probe_index.setdefault(cell, len(self.probe_index))
+
+        self.probe_map = np.full((self.width, self.width), -1, dtype=np.int32)
+        for cell, index in self.probe_index.items():
+            self.probe_map[cell] = index
+        self.probe_ang_flux = np.zeros((len(self.probe_index),) + self.batchShape() + (self.num_angles,),
+                                       dtype=self.dtype)
+
+    # get the cell of the swept quarter a cell is the mirror image of
+    def probeImage(self, y, x):
+
+        if self.symmetry is None:
+            return (y, x)
+        return (max(y, self.width - 1 - y), max(x, self.width - 1 - x))
+
+    # get the angular fluxes of a probe cell in low-memory mode (indexed
+    # [..., angle] like a cell of cell_ang_flux), unfolding a
+    # symmetry-reduced solve the same way as transposeQuadrant and
+    # mirrorQuarter
+    def probeAngularFlux(self, y, x):
+
+        if y*self.width + x not in self.probe_cells:
+            raise ValueError('cell ' + str(y*self.width + x) + ' is not a probe cell')
+        self.makeProbes()
+
+        if self.symmetry is None:
+            return self.probe_ang_flux[self.probe_index[(y, x)]]
+
+        nq = self.num_angles//4
+        half = self.width // 2
+        mirror_x = np.concatenate([np.arange(block*nq, (block + 1)*nq) for block in MIRROR_X])
+        mirror_y = np.concatenate([np.arange(block*nq, (block + 1)*nq) for block in MIRROR_Y])
+        y_image, x_image = self.probeImage(y, x)
+        psi = self.probe_ang_flux[self.probe_index[(y_image, x_image)]].copy()
+
+        if self.symmetry == 'eighth':
+            diagonal = self.probe_ang_flux[self.probe_index[(x_image, y_image)]]
+            psi[..., 3*nq:] = diagonal[..., nq:2*nq][..., self.quad['swap']]
+
+        # the middle column (-mu) and row (-eta) of an odd width mesh
+        if self.width % 2 and x_image == half:
+            psi[..., nq:3*nq] = psi[..., mirror_x[nq:3*nq]]
+        if self.width % 2 and y_image == half:
+            psi[..., 2*nq:] = psi[..., mirror_y[2*nq:]]
+
+        if x < half:
+            psi = psi[..., mirror_x]
+        if y < half:
+            psi = psi[..., mirror_y]
+        return psi
+
+    # sweep one quadrant of angles across the mesh
+    def sweepQuadrant(self, quadrant):
+
+        self.tallies = None
+
+        if self.num_workers > 1:
+            self.sweepParallel([quadrant])
+        elif self.sweep == 'cell':
+            self.sweepQuadrantCell(quadrant)
+        elif self.sweep == 'angle':
+            self.sweepQuadrantAngle(quadrant)
+        elif self.sweep == 'wavefront':
+            self.sweepQuadrantWavefront(quadrant)
+        else:
+            raise ValueError('unknown sweep mode ' + str(self.sweep))
+
+    # get the views of the mesh arrays used to sweep a quadrant (the sweep
+    # map is up to date after sweepCoefficients)
+    def quadrantViews(self, quadrant):
+
+        if self.low_memory:
+            return sweeper.quadrantViews(self.ang_flux, self.quadrant_flux, self.sweep_map, self.cell_source,
+                                         quadrant, first=self.domainFirst(quadrant),
+                                         slot=quadrant[6]*self.quadrantSlots())
+
+        return sweeper.quadrantViews(self.ang_flux, self.cell_ang_flux, self.sweep_map,
+                                     self.cell_source, quadrant, first=self.domainFirst(quadrant))
+
+    # get the extra kernel arguments of a low-memory sweep of a quadrant:
+    # the quadrature weights and the probe views
+    def lowMemoryArgs(self, quadrant):
+
+        if not self.low_memory:
+            return {}
+
+        args = {'weights': self.quad['weight']}
+        if self.probe_map is not None:
+            args['probe_map'], args['probe_flux'] = sweeper.probeViews(
+                self.probe_map, self.probe_ang_flux, quadrant, first=self.domainFirst(quadrant))
+        return args
+
+    # get the views of the denominators and streaming coefficients used to
+    # sweep a quadrant
+    def coefficientViews(self, quadrant):
+
+        mu_coef, eta_coef, denom = self.sweepCoefficients()
+        return sweeper.coefficientViews(denom, mu_coef, eta_coef, quadrant, first=self.domainFirst(quadrant))
+
+    # sweep one quadrant, looping over each angle in each cell
+    def sweepQuadrantCell(self, quadrant):
+
+        coefficients = self.coefficientViews(quadrant)
+        sweeper.sweepCells(*self.quadrantViews(quadrant), *coefficients, **self.lowMemoryArgs(quadrant))
+
+    # sweep one quadrant, updating all of its angles in a cell at once
+    def sweepQuadrantAngle(self, quadrant):
+
+        coefficients = self.coefficientViews(quadrant)
+        sweeper.sweepAngles(*self.quadrantViews(quadrant), *coefficients, **self.lowMemoryArgs(quadrant))
+
+    # sweep one quadrant, solving each anti-diagonal of cells at once
+    def sweepQuadrantWavefront(self, quadrant):
+
+        coefficients = self.coefficientViews(quadrant)
+        sweeper.sweepWavefront(*self.quadrantViews(quadrant), *coefficients, **self.lowMemoryArgs(quadrant))
+
+    # sweep quadrants on the worker pool, splitting the angles of each
+    # quadrant across the workers
+    def sweepParallel(self, quadrants):
+
+        self.tallies = None
+
+        if self.parallel not in ('angle', 'quadrant'):
+            raise ValueError('unknown parallel mode ' + str(self.parallel))
+
+        coefficients = self.sweepCoefficients()
+
+        # (re)create the pool when the worker count or the number of
+        # quadrant slots changes
+        if self.pool is not None and (self.pool.num_workers != self.num_workers or
+                                      self.low_memory and self.pool.arrays['quadrant_flux'].shape != self.quadrant_flux.shape):
+            self.close()
+        if self.pool is None:
+            self.pool = parallel.SweepPool(self, self.num_workers)
+        self.pool.attach(self)
+
+        num_chunks = self.quadrantSlots()
+        weights = self.quad['weight'] if self.low_memory else None
+        self.pool.sweep(quadrants, num_chunks, coefficients,
+                        [self.domainFirst(quadrant) for quadrant in quadrants], weights, num_chunks)
+
+    # shut down the worker pool and move the mesh arrays out of shared memory
+    def close(self):
+
+        if self.pool is not None:
+            self.pool.close(self)
+            self.pool = None
+
+    # get the streaming coefficients 2 mu / h and 2 eta / h, which are the
+    # same for every cell, and the diamond difference denominator, which
+    # only depends on the material and group. The sweep map gives the row of
+    # the denominator table of each cell, which is its material. The tables
+    # are built the first time they are needed and kept until the
+    # materials, material map, quadrature order or mesh size change.
+    #
+    # On a graded mesh the streaming coefficients are given for each column
+    # (2 mu / h_x) and row (2 eta / h_y), and the denominator is tabulated
+    # for every combination of material, column width and row width on the
+    # mesh, which the sweep map indexes instead.
+    def sweepCoefficients(self):
+
+        key = (self.order, self.mesh_size, tuple(self.mat_sigma_t.ravel()), self.material_map.tobytes())
+
+        if self.coefficients is None or self.coefficients[0] != key:
+            if self.graded:
+                mu_coef, eta_coef, denom, self.sweep_map = self.gradedCoefficients()
+            else:
+                mu_coef = 2 * self.quad['mu']/self.mesh_size
+                eta_coef = 2 * self.quad['eta']/self.mesh_size
+                denom = self.mat_sigma_t[..., np.newaxis] + mu_coef + eta_coef
+                self.sweep_map = self.material_map
+            self.coefficients = (key, tuple(np.asarray(coef, dtype=self.dtype) for coef in (mu_coef, eta_coef, denom)))
+
+        return self.coefficients[1]
 
+    # build the streaming coefficients, denominator table and sweep map of
+    # a graded mesh (see sweepCoefficients)
+    def gradedCoefficients(self):
+
+        batch = (1,) * len(self.batchShape())
+        x_sizes, x_index = np.unique(self.x_widths, return_inverse=True)
+        y_sizes, y_index = np.unique(self.y_widths, return_inverse=True)
+
+        # number the (material, row width, column width) classes of the cells
+        classes = (self.material_map.astype(np.int64) * len(y_sizes) + y_index[:, np.newaxis]) * len(x_sizes) \
+            + x_index[np.newaxis, :]
+        classes, sweep_map = np.unique(classes, return_inverse=True)
+        sweep_map = sweep_map.reshape(self.material_map.shape).astype(np.int32)
+        materials = classes // (len(x_sizes) * len(y_sizes))
+        class_y = y_sizes[(classes // len(x_sizes)) % len(y_sizes)]
+        class_x = x_sizes[classes % len(x_sizes)]
+
+        def perCell(mu, widths):
+            return (2 * mu / widths[:, np.newaxis]).reshape((len(widths),) + batch + (len(mu),))
 
-            # sweep in the positive mu and negative eta direction (top left corner)
-            for y in reversed(range(cw)):
-                for x in range(cw):
+        mu_coef = perCell(self.quad['mu'], self.x_widths)
+        eta_coef = perCell(self.quad['eta'], self.y_widths)
+        denom = self.mat_sigma_t[materials][..., np.newaxis] + perCell(self.quad['mu'], class_x) \
+            + perCell(self.quad['eta'], class_y)
+
+        return mu_coef, eta_coef, denom, sweep_map
+
+    # copy the outgoing edge fluxes of a quadrant into the incoming edge
+    # fluxes of the quadrants mirrored across the right/left (if x is set)
+    # and top/bottom (if y is set)
+    def reflectQuadrant(self, quadrant, x=True, y=True):
+
+        nq = self.num_angles//4
+        x_edge, x_off, y_edge, y_off = quadrant[2:6]
+
+        if x:
+            self.ang_flux[2 - x_edge, ..., x_off*nq:(x_off+1)*nq] = self.ang_flux[x_edge, ..., x_off*nq:(x_off+1)*nq]
+        if y:
+            self.ang_flux[4 - y_edge, ..., y_off*nq:(y_off+1)*nq] = self.ang_flux[y_edge, ..., y_off*nq:(y_off+1)*nq]
+
+    # reflect the outgoing edge fluxes of all four quadrants at once; each
+    # quadrant's outgoing edge fluxes become the incoming edge fluxes of
+    # its mirror, so the left/right and bottom/top buffers trade places
+    def reflectAll(self):
+
+        self.ang_flux[[0, 1, 2, 3]] = self.ang_flux[[2, 3, 0, 1]]
+
+    # compute every tally from one angular integration of the cell angular
+    # fluxes: the normalized scalar flux, the fuel and total rxn rates, the
+    # fuel to coolant flux ratio and the L2 norm of the change in scalar
+    # flux since the last tally. The results are kept until the next sweep.
+    # For multigroup problems every tally but eps is group-wise.
+    def computeTallies(self):
+
+        if self.tallies is not None:
+            return self.tallies
+
+        flux = self.integrateFlux()
+        self.scalar_flux = flux
+
+        fuel = self.mat_is_fuel[self.material_map]
+        rxn_rate = flux * self.mat_sigma_t[self.material_map] * self.cell_area
+
+        # normalize the scalar flux and compare with the previous one
+        self.old_flux = self.flux
+        self.flux = flux / self.averageFlux(flux)
+
+        self.tallies = {}
+        self.tallies['RR_fuel'] = np.sum(rxn_rate[fuel], axis=0)
+        self.tallies['RR_total'] = np.sum(rxn_rate, axis=(0, 1))
+        self.tallies['flux_ratio'] = self.averageFlux(flux, fuel) / self.averageFlux(flux, ~fuel)
+        self.tallies['eps'] = sqrt(np.sum((self.flux - self.old_flux)**2))
+
+        return self.tallies
+
+    # integrate the cell angular fluxes over angle (in low-memory mode, add
+    # up the weighted sums of the quadrant slots) into a float64 scalar flux
+    def integrateFlux(self):
+
+        if self.low_memory:
+            return np.sum(self.quadrant_flux, axis=-1)
 
-                    cell = self.cells[y*cw+x]
-                    source = cell.material.source
-
-                    for angle in range(na//4):
-
-                        # compute cell centered flux
-                        cell.ang_flux[3*na//4 + angle] = (source + 2 * self.quad['mu'][angle]/self.mesh_size * self.ang_flux[0, y, angle + na//4] +
-                                                          2 * self.quad['eta'][angle]/self.mesh_size * self.ang_flux[3, x, angle]) / \
-                                                          (cell.material.sigma_t + 2 * self.quad['mu'][angle]/self.mesh_size + 2 * self.quad['eta'][angle]/self.mesh_size)
+        na = self.num_angles
+        psi = self.cell_ang_flux.reshape(-1, na)
+        if self.dtype != np.float64:
+            return np.einsum('ij,j->i', psi, self.quad['weight_all'], dtype=np.float64).reshape(self.flux.shape)
+        return np.dot(psi, self.quad['weight_all']).reshape(self.flux.shape)
 
-                        # sweep from left to right
-                        self.ang_flux[0, y, angle + na//4] = 2 * cell.ang_flux[3*na//4+ angle] - self.ang_flux[0, y, angle + na//4]
+    # get the average of a flux over the mesh, or over the cells selected by
+    # a mask, weighting the cells by their areas
+    def averageFlux(self, flux, cells=None):
 
-                        # sweep from bottom to top
-                        self.ang_flux[3, x, angle] = 2 * cell.ang_flux[3*na//4+ angle] - self.ang_flux[3, x, angle]
+        if not self.graded:
+            if cells is None:
+                return np.mean(flux, axis=(0, 1))
+            return np.mean(flux[cells], axis=0)
 
-            # update the boundary angular fluxes
-            if update:
-                # reflect on right boundary
-                for y in range(cw):
-                    for angle in range(na//4):
-                        self.ang_flux[2, y, angle + na//4] = self.ang_flux[0, y, angle + na//4]
+        area = self.y_widths[:, np.newaxis] * self.x_widths
+        if cells is None:
+            cells = np.ones(area.shape, dtype=bool)
+        return np.tensordot(area[cells], flux[cells], axes=1) / np.sum(area[cells])
 
-                # reflect flux on bottom boundary
-                for x in range(cw):
-                    for angle in range(na//4):
-                        self.ang_flux[1, x, angle] = self.ang_flux[3, x, angle]
+    # get the normalized scalar flux summed over the groups, for plotting
+    def totalFlux(self):
 
-            # if vacuum case, plot scalar flux and compute fuel rxn rate
-            if update == False:
-                self.RR_isolated = self.computeRRFuel()
+        if self.num_groups == 1:
+            return self.flux
 
-                # plot the scalar flux for vacuum boundary case
-                self.computeScalarFlux()
-                pttr.plotScalarFlux(self, self.order, self.mesh_size, iteration+100)
+        flux = np.sum(self.scalar_flux, axis=-1)
+        return flux / self.averageFlux(flux)
 
-                # zero out angular flux
-                for i in range(4):
-                    for x in range(cw):
-                        for angle in range(na//2):
-                            self.ang_flux[i, x, angle] = 0.0
+    # get the (y_widths, x_widths) cell widths for plotting a graded mesh,
+    # or None for a uniform mesh
+    def plotWidths(self):
 
-            # plot the scalar flux for reflective boundary case and compute eps
-            if update:
-                self.computeScalarFlux()
-                pttr.plotScalarFlux(self, self.order, self.mesh_size, iteration)
-                eps = self.computeL2Norm()
-
-            # check for convergence; if convgerged comput dancoff factor and flux ratio
-            if (update and eps < self.tol):
-                self.RR_lattice = self.computeRRFuel()
-                self.RR_total = self.computeRRTotal()
-                self.flux_ratio = self.computeFluxRatio()
-                self.dancoff = 1 - (1.0 - self.RR_lattice / self.RR_total) / (1.0 - self.RR_isolated / self.RR_total)
-                self.dancoff2 = 1 - (1.0 / self.fuel.sigma_t)
-                print('EPS converged ' + str(eps))
-                print('RR isolated ' + str(self.RR_isolated))
-                print('RR lattice ' + str(self.RR_lattice))
-                print('flux ratio ' + str(self.flux_ratio))
-                print('Dancoff factor ' + str(self.dancoff))
-                break
+        if self.graded:
+            return (self.y_widths, self.x_widths)
+        return None
 
     # compute the scalar fuel to coolant ratio
     def computeFluxRatio(self):
 
-        # zero flux
-        flux_fuel = 0.0
-        flux_coolant = 0.0
-        fuel_cells = 0
-        coolant_cells = 0
-
-        # compute scalar flux in each cell
-        for y in range(self.width):
-            for x in range(self.width):
-                cell = self.cells[y*self.width+x]
-
-                if cell.material.mat_type == 'fuel':
-                    flux_fuel += cell.flux
-                    fuel_cells += 1
-                else:
-                    flux_coolant += cell.flux
-                    coolant_cells += 1
-
-        ratio = (flux_fuel/fuel_cells) / (flux_coolant/coolant_cells)
-
-        return ratio
-
+        return self.computeTallies()['flux_ratio']
 
     # compute the rxn rate in the fuel
     def computeRRFuel(self):
 
-        # set old flux
-        for y in range(self.width):
-            for x in range(self.width):
-                self.cells[y*self.width+x].flux = 0.0
-
-        # compute scalar flux in each cell
-        for y in range(self.width):
-            for x in range(self.width):
-                cell = self.cells[y*self.width+x]
-
-                for angle in range(self.num_angles//4):
-                    cell.flux += self.quad['weight'][angle] * (cell.ang_flux[angle] + cell.ang_flux[angle + self.num_angles//4] + cell.ang_flux[angle + self.num_angles//2] + cell.ang_flux[angle + 3*self.num_angles//4])
-
-        # compute average scalar flux
-        RR_fuel = 0.0
-        for y in range(self.width):
-            for x in range(self.width):
-
-                if self.cells[y*self.width+x].material.mat_type == 'fuel':
-                    RR_fuel += self.cells[y*self.width+x].flux * self.cells[y*self.width+x].material.sigma_t * self.mesh_size**2
-
-        return RR_fuel
+        return self.computeTallies()['RR_fuel']
 
     # compute the total rxn rate
     def computeRRTotal(self):
 
-        # set old flux
-        for y in range(self.width):
-            for x in range(self.width):
-                self.cells[y*self.width+x].flux = 0.0
-
-        # compute scalar flux in each cell
-        for y in range(self.width):
-            for x in range(self.width):
-                cell = self.cells[y*self.width+x]
-
-                for angle in range(self.num_angles//4):
-                    cell.flux += self.quad['weight'][angle] * (cell.ang_flux[angle] + cell.ang_flux[angle + self.num_angles//4] + cell.ang_flux[angle + self.num_angles//2] + cell.ang_flux[angle + 3*self.num_angles//4])
-
-        # compute average scalar flux
-        RR_total = 0.0
-        for y in range(self.width):
-            for x in range(self.width):
-                RR_total += self.cells[y*self.width+x].flux * self.cells[y*self.width+x].material.sigma_t * self.mesh_size**2
-
-        return RR_total
+        return self.computeTallies()['RR_total']
 
     # compute the L2 Norm of the scalar flux between iterations
     def computeL2Norm(self):
 
-        eps = 0.0
-
-        for y in range(self.width):
-            for x in range(self.width):
-                eps += (self.cells[y*self.width+x].flux - self.cells[y*self.width+x].old_flux)**2
-
-        sqrt(eps)
-
-        return eps
-
+        return self.computeTallies()['eps']
 
     # compute and normalize the scalar flux
     def computeScalarFlux(self):
 
-        # set old flux
-        for y in range(self.width):
-            for x in range(self.width):
-                self.cells[y*self.width+x].old_flux = self.cells[y*self.width+x].flux
-                self.cells[y*self.width+x].flux = 0.0
-
-        # compute scalar flux in each cell
-        for y in range(self.width):
-            for x in range(self.width):
-                cell = self.cells[y*self.width+x]
-
-                for angle in range(self.num_angles//4):
-                    cell.flux += self.quad['weight'][angle] * (cell.ang_flux[angle] + cell.ang_flux[angle + self.num_angles//4] + cell.ang_flux[angle + self.num_angles//2] + cell.ang_flux[angle + 3*self.num_angles//4])
-
-
-        # compute average scalar flux
-        avg_flux = 0.0
-        for y in range(self.width):
-            for x in range(self.width):
-                avg_flux += self.cells[y*self.width+x].flux
-
-        avg_flux = avg_flux / (self.width**2)
-
-        # normalize flux
-        for y in range(self.width):
-            for x in range(self.width):
-                self.cells[y*self.width+x].flux = self.cells[y*self.width+x].flux / avg_flux
+        self.computeTallies()
@@ -0,0 +1,148 @@
+import numpy as np
+
+# Pin cell geometry on a uniform square mesh or a graded rectilinear mesh.
+#
+# A pin is a set of concentric regions centred in the cell, each given by
+# its outer size (the diameter of a circle or the side of a square) and a
+# material index. Regions are filled from the outside in, so a fuel pin
+# with gap and clad is given as the fuel, gap and clad regions with
+# increasing sizes and every cell outside all of them gets the background
+# (moderator) material.
+#
+# A cell is inside a square region if all of it is, and inside a circle if
+# its centre is. A graded mesh is given by the (y_widths, x_widths) cell
+# widths and uses the same rules, so uniform widths give the map of the
+# uniform mesh.
+
+# relative tolerance of the cell edges that lie on the side of a square
+EDGE_TOLERANCE = 1e-9
+
+
+# get the cell centre coordinates of a width x width mesh, or of a graded
+# mesh with the given (y_widths, x_widths), as arrays that broadcast to
+# [y, x]
+def cellCenters(width, mesh_size, widths=None):
+
+    if widths is not None:
+        y_widths, x_widths = widths
+        y = np.cumsum(y_widths) - 0.5 * np.asarray(y_widths)
+        x = np.cumsum(x_widths) - 0.5 * np.asarray(x_widths)
+        return y[:, np.newaxis], x[np.newaxis, :]
+
+    centers = (np.arange(width) + 0.5) * mesh_size
+
+    return centers[:, np.newaxis], centers[np.newaxis, :]
+
+
+# get the mask of cells lying entirely inside a centred square from the
+# cell edges along y and x measured from the centre of the mesh and half the
+# side of the square, in the same units
+def edgeSquareMask(y_edges, x_edges, half):
+
+    # (edges summed from cell widths miss the side of the square by
+    # rounding, so the side is widened by a relative EDGE_TOLERANCE)
+    half = half * (1.0 + EDGE_TOLERANCE)
+    y = (y_edges[:-1] >= -half) & (y_edges[1:] <= half)
+    x = (x_edges[:-1] >= -half) & (x_edges[1:] <= half)
+
+    return y[:, np.newaxis] & x[np.newaxis, :]
+
+
+# get the mask of cells inside a centred square with sides of the given
+# size, rounded down to whole cells
+def squareMask(width, mesh_size, size):
+
+    # (the edges are counted in cells, so they are exact)
+    edges = np.arange(width + 1) - width / 2
+
+    return edgeSquareMask(edges, edges, size / mesh_size / 2)
+
+
+# get the mask of cells of a graded mesh inside a centred square with sides
+# of the given size, by the same rule as squareMask
+def gradedSquareMask(widths, pitch, size):
+
+    y_widths, x_widths = widths
+    y_edges = np.concatenate([[0.0], np.cumsum(y_widths)]) - pitch/2.0
+    x_edges = np.concatenate([[0.0], np.cumsum(x_widths)]) - pitch/2.0
+
+    return edgeSquareMask(y_edges, x_edges, size/2.0)
+
+
+# get the mask of cells whose centres lie inside a centred circle of the
+# given diameter
+def circleMask(width, mesh_size, pitch, diameter, widths=None):
+
+    y, x = cellCenters(width, mesh_size, widths)
+    radius = np.sqrt((pitch/2.0 - y)**2 + (pitch/2.0 - x)**2)
+
+    return radius <= diameter/2.0
+
+
+# get the mask of cells inside a region of a 'square' or 'circle' pin
+def regionMask(geometry, width, mesh_size, pitch, size, widths=None):
+
+    if geometry == 'square':
+        if widths is not None:
+            return gradedSquareMask(widths, pitch, size)
+        return squareMask(width, mesh_size, size)
+    elif geometry == 'circle':
+        return circleMask(width, mesh_size, pitch, size, widths)
+    else:
+        raise ValueError('unknown geometry ' + str(geometry))
+
+
+# get the material index of each cell, indexed [y, x], for a pin made of
+# the given (size, material index) regions in a background material
+def makeMaterialMap(geometry, width, mesh_size, pitch, regions, background, dtype=np.uint8, widths=None):
+
+    material_map = np.full((width, width), background, dtype=dtype)
+
+    for size, material in sorted(regions, key=lambda region: -region[0]):
+        material_map[regionMask(geometry, width, mesh_size, pitch, size, widths)] = material
+
+    return material_map
+
+
+# get the widths of cells growing by a factor growth from fine at the start
+# of a segment up to at most coarse, scaled to fill the segment exactly
+def gradedSegment(length, fine, coarse, growth):
+
+    widths = []
+    width = fine
+    while sum(widths) < length:
+        widths.append(width)
+        width = min(width * growth, coarse)
+
+    return np.array(widths) * (length / sum(widths))
+
+
+# get the cell widths across a pin cell graded from fine cells at every
+# region boundary (e.g. the fuel surface), growing by a factor growth to at
+# most coarse cells in the fuel interior and the moderator. sizes are the
+# region sizes (diameters of circles or sides of squares). The widths are
+# symmetric about the centre of the cell.
+def gradedWidths(pitch, sizes, fine, coarse, growth=1.3):
+
+    if growth < 1.0:
+        raise ValueError('the growth factor must be at least 1')
+
+    # from the centre of the cell out to the edge; segments between two
+    # region boundaries are graded from both ends
+    bounds = [0.0] + sorted(size/2.0 for size in sizes) + [pitch/2.0]
+    half = []
+    for i, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:])):
+        length = stop - start
+        if i == 0:
+            half.extend(gradedSegment(length, fine, coarse, growth)[::-1])
+        elif i == len(bounds) - 2:
+            half.extend(gradedSegment(length, fine, coarse, growth))
+        else:
+            segment = gradedSegment(length/2.0, fine, coarse, growth)
+            half.extend(segment)
+            half.extend(segment[::-1])
+
+    half = np.array(half)
+
+    return np.concatenate([half[::-1], half])
+
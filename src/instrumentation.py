@@ -0,0 +1,107 @@
+import contextlib
+import json
+import time
+
+# Per-phase timers, counters and event callbacks for the Sn solver.
+#
+# A Mesh keeps an Instrumentation object as mesh.stats. The solver wraps
+# each phase (quadrant sweeps, boundary reflection, tallies, plotting,
+# convergence checks, ...) in stats.phase(name) and counts work with
+# stats.count(name, n). When instrumentation is disabled phase returns a
+# shared no-op context and count returns at once, so the cost is one
+# attribute check per call. Callbacks get every event (e.g. the end of an
+# iteration) whether or not timing is enabled.
+
+# context returned by phase when timing is disabled
+_disabled_phase = contextlib.nullcontext()
+
+
+class PhaseTimer(object):
+
+    # add the time spent in a with block to a timer of an Instrumentation
+    def __init__(self, stats, name):
+
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+
+        self.stats.addTime(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Instrumentation(object):
+
+    def __init__(self, enabled=False):
+
+        self.enabled = enabled
+        self.callbacks = []
+        self.reset()
+
+    # clear the timers, counters and histories
+    def reset(self):
+
+        self.times = {}
+        self.calls = {}
+        self.counters = {}
+        self.history = {}
+
+    # get a context that times a phase
+    def phase(self, name):
+
+        if not self.enabled:
+            return _disabled_phase
+        return PhaseTimer(self, name)
+
+    # add time to a phase timer
+    def addTime(self, name, seconds):
+
+        self.times[name] = self.times.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    # add n to a counter
+    def count(self, name, n=1):
+
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    # append a value to a history (e.g. eps per iteration)
+    def append(self, name, value):
+
+        if self.enabled:
+            self.history.setdefault(name, []).append(value)
+
+    # register fn(event, data) to be called on every event
+    def addCallback(self, fn):
+
+        self.callbacks.append(fn)
+
+    def removeCallback(self, fn):
+
+        self.callbacks.remove(fn)
+
+    # pass an event and its data (a dictionary) to the callbacks
+    def emit(self, event, data):
+
+        for fn in self.callbacks:
+            fn(event, data)
+
+    # get the timers, counters and histories as plain dictionaries
+    def toDict(self):
+
+        stats = {}
+        stats['enabled'] = self.enabled
+        stats['timers'] = {name: {'time': self.times[name], 'calls': self.calls[name]} for name in self.times}
+        stats['counters'] = dict(self.counters)
+        stats['history'] = {name: list(values) for name, values in self.history.items()}
+
+        return stats
+
+    def toJSON(self, **kwargs):
+
+        return json.dumps(self.toDict(), sort_keys=True, **kwargs)
@@ -0,0 +1,244 @@
+import numpy as np
+import warnings
+import contextlib
+import parallel
+import acceleration
+from batch import VariantBatch
+from discrete_ordinates import QUADRANTS
+
+# Multi-pin lattices solved by spatial domain decomposition.
+#
+# A Lattice is an N x M grid of pin cell meshes, each with its own materials
+# and fuel diameter (a water hole is a pin with fuel_diameter=0), with
+# reflective boundaries around the whole grid. Every pin is a subdomain: the
+# pins are stacked and swept like the variants of a batch (see batch), each
+# with the incoming edge fluxes of the last iteration, and the outgoing edge
+# fluxes (the ang_flux edge buffers) are then passed on to the neighbouring
+# pins, or reflected on the lattice boundary (block Jacobi iteration). On
+# its own block Jacobi needs many iterations to carry the fluxes across a
+# lattice of unlike pins, so by default the edge fluxes of all pins are
+# mixed with Anderson acceleration (see acceleration), which needs far
+# fewer. With num_workers > 1 the pins are split into strips of consecutive
+# pins swept by worker processes on the stacked arrays in shared memory.
+#
+# Each pin keeps its own tallies: RR_isolated comes from the vacuum solve of
+# the pin on its own, and RR_lattice, the flux ratio and the Dancoff factor
+# from its fluxes in the lattice.
+
+# the pin an edge buffer gets its incoming fluxes from, as a (row, column)
+# step: the x buffers 0 (+mu) and 2 (-mu) from the left and right, the y
+# buffers 1 (+eta) and 3 (-eta) from below and above
+NEIGHBOURS = [(0, -1), (-1, 0), (0, 1), (1, 0)]
+
+
+# silence the warnings of the tallies of water holes, whose fuel tallies
+# are averages over no cells and which have no flux to normalize until
+# their neighbours' fluxes reach them
+@contextlib.contextmanager
+def waterHoleTallies():
+
+    with warnings.catch_warnings(), np.errstate(divide='ignore', invalid='ignore'):
+        warnings.simplefilter('ignore', RuntimeWarning)
+        yield
+
+
+class Lattice(VariantBatch):
+
+    # pins           rows of pin cell meshes with their materials set up,
+    #                the bottom row first and each row from left to right.
+    #                The pins need the same cell widths, quadrature order,
+    #                number of groups and dtype, and take no acceleration
+    #                (graded pins need acceleration=None).
+    # tolerance      convergence tolerance of the largest eps of the pins
+    #                (the tolerance of the first pin by default)
+    # num_workers    number of worker processes sweeping the pins
+    # acceleration   'anderson' to mix the edge fluxes (and with scattering
+    #                the scalar fluxes) of all pins, or None for plain block
+    #                Jacobi iteration
+    # anderson_depth number of previous iterates used in the mixing; the
+    #                mixer keeps depth + 1 copies of the state of every pin
+    def __init__(self, pins, tolerance=None, num_workers=1, acceleration='anderson',
+                 anderson_depth=20):
+
+        rows = [list(row) for row in pins]
+        if not rows or not rows[0] or any(len(row) != len(rows[0]) for row in rows):
+            raise ValueError('the pins of a lattice must form a full grid')
+
+        VariantBatch.__init__(self, [pin for row in rows for pin in row])
+
+        first = self.meshes[0]
+        for pin in self.meshes:
+            if not (np.array_equal(pin.x_widths, first.x_widths) and np.array_equal(pin.y_widths, first.y_widths)):
+                raise ValueError('the pins of a lattice need the same cell widths')
+            if pin.acceleration is not None:
+                raise ValueError('lattice solves do not support acceleration ' + str(pin.acceleration))
+
+        if acceleration not in (None, 'anderson'):
+            raise ValueError('unknown lattice acceleration ' + str(acceleration))
+
+        self.shape          = (len(rows), len(rows[0]))
+        self.tol            = first.tol if tolerance is None else tolerance
+        self.num_workers    = num_workers
+        self.acceleration   = acceleration
+        self.anderson_depth = anderson_depth
+        self.pool           = None
+        self.links          = self.makeLinks()
+
+    # get the pins an edge buffer of each pin gets its incoming fluxes from
+    # and the buffer of that pin they are taken from: the same buffer of the
+    # neighbour, or the opposite buffer of the pin itself on the lattice
+    # boundary (a reflection)
+    def makeLinks(self):
+
+        rows, cols = self.shape
+        links = []
+        for edge, (row_step, col_step) in enumerate(NEIGHBOURS):
+            sources = np.arange(rows * cols)
+            buffers = np.full(rows * cols, (edge + 2) % 4)
+            for row in range(rows):
+                for col in range(cols):
+                    if 0 <= row + row_step < rows and 0 <= col + col_step < cols:
+                        sources[row*cols + col] = (row + row_step)*cols + col + col_step
+                        buffers[row*cols + col] = edge
+            links.append((sources, buffers))
+
+        return links
+
+    # pass the outgoing edge fluxes of every pin on to the incoming edge
+    # fluxes of its neighbours
+    def exchange(self):
+
+        outgoing = self.ang_flux.copy()
+        for edge, (sources, buffers) in enumerate(self.links):
+            for buffer in (edge, (edge + 2) % 4):
+                pins = np.flatnonzero(buffers == buffer)
+                self.ang_flux[edge][:, pins] = outgoing[buffer][:, sources[pins]]
+
+    # sweep the four quadrants of every pin, on the worker pool if there is
+    # one, and exchange the edge fluxes for the reflective boundary case
+    def sweepQuadrants(self, coefficients, update):
+
+        if self.pool is not None:
+            self.pool.sweepBatches(QUADRANTS, self.subdomains(), coefficients)
+        else:
+            VariantBatch.sweepQuadrants(self, coefficients, False)
+
+        if update:
+            self.exchange()
+
+    # get the (start, stop) ranges of consecutive pins swept by each worker
+    def subdomains(self):
+
+        bounds = np.linspace(0, len(self.active), min(self.num_workers, len(self.active)) + 1).astype(int)
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    # solve the vacuum boundary problem of every pin on its own
+    # (update=False) or run up to num_iter lattice iterations (update=True)
+    def solveSn(self, update, num_iter):
+
+        if not update:
+            with waterHoleTallies():
+                VariantBatch.solveSn(self, False, num_iter)
+            return
+
+        for pin in self.meshes:
+            pin.updateMaterials()
+
+        self.stack(self.meshes)
+        try:
+            if self.num_workers > 1:
+                self.sweepCoefficients()
+                self.pool = parallel.SweepPool(self, self.num_workers)
+                self.point()
+            with waterHoleTallies():
+                self.iterateLattice(num_iter)
+        finally:
+            self.drop(self.active)
+            if self.pool is not None:
+                self.pool.close(self)
+                self.pool = None
+
+        for pin in self.meshes:
+            pin.stats.emit('solve', {'update': True, 'num_iterations': self.num_iterations,
+                                     'converged': self.converged})
+
+    # run the lattice iterations until the largest eps of the pins is below
+    # the tolerance. Scattering sources are iterated along with the edge
+    # fluxes, without DSA, as the diffusion operator of a pin has no
+    # neighbours.
+    def iterateLattice(self, num_iter):
+
+        self.eps_history = []
+        for pin in self.active:
+            pin.eps_history = []
+            pin.residual_history = []
+
+        mixer = None
+        if self.acceleration == 'anderson':
+            mixer = acceleration.AndersonMixer(self.anderson_depth)
+
+        for iteration in range(num_iter):
+            state = self.iterationState()
+            self.sweepAll(True)
+            if mixer is not None:
+                self.setIterationState(mixer.update(state, self.iterationState()))
+
+            tallies = [pin.computeTallies() for pin in self.active]
+            for pin, pin_tallies in zip(self.active, tallies):
+                pin.eps_history.append(pin_tallies['eps'])
+                pin.stats.append('eps', pin_tallies['eps'])
+                pin.stats.count('iterations')
+
+            # (a water hole has no eps until its flux is nonzero)
+            eps = np.fmax.reduce([pin_tallies['eps'] for pin_tallies in tallies])
+            self.eps_history.append(eps)
+
+            # (the first iteration repeats the vacuum sweep, so it is skipped)
+            converged = eps < self.tol and iteration > 0
+            for pin in self.active:
+                pin.stats.emit('iteration', {'iteration': iteration, 'update': True, 'eps': eps,
+                                             'converged': converged})
+
+            if converged or iteration == num_iter - 1:
+                for pin, pin_tallies in zip(self.active, tallies):
+                    pin.finishReflective(pin_tallies, pin_tallies['eps'], converged, iteration, mixer)
+                self.converged = converged
+                self.num_iterations = iteration + 1
+                break
+
+        self.RR_isolated = self.pinArray('RR_isolated')
+        self.RR_lattice = self.pinArray('RR_lattice')
+        self.dancoff = self.pinArray('dancoff')
+
+    # get the state of the lattice iteration: the states of the pins (see
+    # Mesh.iterationState) one after the other
+    def iterationState(self):
+
+        return np.concatenate([pin.iterationState().ravel() for pin in self.active])
+
+    # set the state for the next iteration (see iterationState)
+    def setIterationState(self, state):
+
+        start = 0
+        for pin in self.active:
+            size = pin.ang_flux.size + (pin.scalar_flux.size if pin.mat_scatter is not None else 0)
+            pin.setIterationState(state[start:start + size])
+            start += size
+
+    # get a result of every pin as an array indexed [row, column, ...]
+    def pinArray(self, name):
+
+        values = np.array([getattr(pin, name) for pin in self.meshes])
+        return values.reshape(self.shape + values.shape[1:])
+
+    # get the scalar flux of the whole lattice indexed [y, x] (summed over
+    # the groups), normalized to a mean of one
+    def totalFlux(self):
+
+        rows, cols = self.shape
+        flux = [pin.scalar_flux if pin.num_groups == 1 else np.sum(pin.scalar_flux, axis=-1) for pin in self.meshes]
+        flux = np.block([flux[row*cols:(row + 1)*cols] for row in range(rows)])
+        area = self.meshes[0].y_widths[:, np.newaxis] * self.meshes[0].x_widths
+        area = np.tile(area, self.shape)
+
+        return flux / (np.sum(flux * area) / np.sum(area))
@@ -2,8 +2,13 @@
 
 class Material(object):
 
-    def __init__(self, mat_type, sigma_t, source):
+    # sigma_t and source are numbers for a one group problem or sequences of
+    # the group values for a multigroup problem (group 0 has the highest
+    # energy); sigma_s is the group to group scattering cross section,
+    # indexed [from group, to group]
+    def __init__(self, mat_type, sigma_t, source, sigma_s=None):
 
         self.mat_type = mat_type
         self.sigma_t = sigma_t
         self.source = source
+        self.sigma_s = sigma_s
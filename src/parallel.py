@@ -0,0 +1,178 @@
+import numpy as np
+import os
+import multiprocessing
+import weakref
+from multiprocessing import shared_memory
+import sweeper
+
+# Parallel quadrant sweeps on a pool of worker processes.
+#
+# The mesh edge buffers (ang_flux), cell angular fluxes (cell_ang_flux),
+# sweep map (see Mesh.sweepCoefficients) and cell sources are moved into
+# shared memory when the pool is created, so the workers sweep the mesh
+# arrays in place and only the quadrant, the angle range and the small
+# coefficient arrays are sent per task.
+# Angles of a quadrant never touch each other's edge fluxes or cell
+# fluxes, so every task writes a disjoint part of the shared arrays. In
+# low-memory mode each task writes the weighted angular sums of its angles
+# to its own slot of the quadrant fluxes.
+
+# the mesh arrays kept in shared memory (those the mesh has)
+SHARED_ARRAYS = ['ang_flux', 'cell_ang_flux', 'quadrant_flux', 'probe_map', 'probe_ang_flux',
+                 'sweep_map', 'cell_source']
+
+# shared arrays attached by a worker process, keyed by name
+_arrays = {}
+_blocks = []
+
+
+# attach a worker process to the shared mesh arrays
+def _attach(specs):
+
+    for name, (shm_name, shape, dtype) in specs.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        _blocks.append(shm)
+        _arrays[name] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+# sweep a range of angles of a quadrant in a worker process
+def _sweep(task):
+
+    quadrant, first, start, stop, slot, denom, mu_coef, eta_coef, weights = task
+
+    cells = _arrays['cell_ang_flux'] if slot is None else _arrays['quadrant_flux']
+    x_flux, y_flux, cell_flux, sweep_map, source = sweeper.quadrantViews(
+        _arrays['ang_flux'], cells, _arrays['sweep_map'], _arrays['cell_source'],
+        quadrant, start, stop, first, slot)
+
+    # low-memory sweeps add up the angles and store the probe cells
+    low_memory = {}
+    if weights is not None:
+        low_memory['weights'] = weights
+        if 'probe_map' in _arrays:
+            low_memory['probe_map'], low_memory['probe_flux'] = sweeper.probeViews(
+                _arrays['probe_map'], _arrays['probe_ang_flux'], quadrant, start, stop, first)
+
+    sweeper.sweepWavefront(x_flux, y_flux, cell_flux, sweep_map, source,
+                           *sweeper.coefficientViews(denom, mu_coef, eta_coef, quadrant, start, stop, first),
+                           **low_memory)
+
+
+# sweep a quadrant of a range of the batch axis of stacked meshes (see
+# batch) in a worker process
+def _sweepBatch(task):
+
+    quadrant, start, stop, denom, mu_coef, eta_coef = task
+
+    batch = slice(start, stop)
+    sweeper.sweepWavefront(*sweeper.quadrantViews(_arrays['ang_flux'][:, :, batch], _arrays['cell_ang_flux'][:, :, batch],
+                                                  _arrays['sweep_map'], _arrays['cell_source'][:, :, batch], quadrant),
+                           *sweeper.coefficientViews(denom, mu_coef, eta_coef, quadrant))
+
+
+# shut down the pool (if it was started) and free the shared memory blocks,
+# in the process that created them only (forked processes inherit the
+# finalizer)
+def _release(pid, pool, blocks):
+
+    if os.getpid() != pid:
+        return
+
+    if pool is not None:
+        pool.terminate()
+        pool.join()
+
+    for shm in blocks:
+        shm.close()
+        shm.unlink()
+
+
+class SweepPool(object):
+
+    # create the worker pool and move the mesh arrays into shared memory
+    def __init__(self, mesh, num_workers):
+
+        self.num_workers = num_workers
+        self.arrays = {}
+        self.blocks = []
+        specs = {}
+
+        # the blocks are freed if the pool cannot be started (e.g. in a
+        # daemonic process), before the mesh is pointed at them
+        try:
+            for name in SHARED_ARRAYS:
+                array = getattr(mesh, name, None)
+                if array is None:
+                    continue
+                shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                self.blocks.append(shm)
+                self.arrays[name] = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+                specs[name] = (shm.name, array.shape, array.dtype.str)
+
+            self.pool = multiprocessing.Pool(num_workers, initializer=_attach, initargs=(specs,))
+        except BaseException:
+            self.arrays = {}
+            _release(os.getpid(), None, self.blocks)
+            raise
+
+        self._finalizer = weakref.finalize(self, _release, os.getpid(), self.pool, self.blocks)
+        self.attach(mesh)
+
+    # point the mesh at the shared arrays, copying in any array the mesh
+    # has replaced since the last sweep
+    def attach(self, mesh):
+
+        for name, shared in self.arrays.items():
+            array = getattr(mesh, name)
+            if array is not shared:
+                shared[...] = array
+                setattr(mesh, name, shared)
+
+    # sweep the given quadrants, splitting the angles of each quadrant
+    # into chunks swept by different workers; firsts gives the first
+    # (row, column) swept for each quadrant (see sweeper.quadrantViews).
+    # Low-memory sweeps pass the quadrature weights of a quadrant and the
+    # number of quadrant flux slots of each quadrant.
+    def sweep(self, quadrants, num_chunks, coefficients, firsts=None, weights=None, slots=1):
+
+        mu_coef, eta_coef, denom = coefficients
+        nq = denom.shape[-1]
+        bounds = np.linspace(0, nq, min(num_chunks, nq) + 1).astype(int)
+        if firsts is None:
+            firsts = [(0, 0)] * len(quadrants)
+
+        tasks = []
+        for quadrant, first in zip(quadrants, firsts):
+            for chunk, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:])):
+                if weights is None:
+                    tasks.append((quadrant, first, start, stop, None, denom, mu_coef, eta_coef, None))
+                else:
+                    tasks.append((quadrant, first, start, stop, quadrant[6]*slots + chunk, denom, mu_coef,
+                                  eta_coef, weights[start:stop]))
+
+        self.pool.map(_sweep, tasks, chunksize=1)
+
+    # sweep the given quadrants of stacked meshes (see batch), splitting
+    # the batch axis into the (start, stop) ranges swept by different
+    # workers; the coefficients are stacked along the batch axis too
+    def sweepBatches(self, quadrants, ranges, coefficients):
+
+        mu_coef, eta_coef, denom = coefficients
+
+        tasks = []
+        for start, stop in ranges:
+            for quadrant in quadrants:
+                tasks.append((quadrant, start, stop, denom[:, start:stop], mu_coef[:, start:stop],
+                              eta_coef[:, start:stop]))
+
+        self.pool.map(_sweepBatch, tasks, chunksize=1)
+
+    # give the mesh private copies of the shared arrays and free the pool
+    def close(self, mesh):
+
+        for name, shared in self.arrays.items():
+            if getattr(mesh, name) is shared:
+                setattr(mesh, name, shared.copy())
+
+        self.arrays = {}
+        self._finalizer()
@@ -5,89 +5,156 @@ from PIL import ImageFont
 from math import *
 import matplotlib.pyplot as plt
 import numpy as np
+import queue
+import threading
+
+# get the pixel size of a cell for a roughly 500 pixel wide image
+def getBitLength(width, bit_size=500.0):
+
+    return max(1, int(round(bit_size / width)))
+
+# scale cell colors, indexed [y, x], up to an RGB image with each cell a
+# bit_length square and y = 0 at the bottom. Neighbouring cells share their
+# border pixels, which go to the right-hand and upper cell. On a graded mesh
+# with the given (y_widths, x_widths) the cells are drawn to scale in an
+# image of the same size.
+def rasterize(colors, bit_length, widths=None):
+
+    width = colors.shape[0]
+    size = bit_length * width
+    pixels = np.arange(size)
+
+    if widths is None:
+        rows = np.minimum((size - pixels) // bit_length, width - 1)
+        cols = pixels // bit_length
+    else:
+        y_edges, x_edges = (np.cumsum(cell_widths) * (size / np.sum(cell_widths)) for cell_widths in widths)
+        rows = np.minimum(np.searchsorted(y_edges, size - pixels, side='right'), width - 1)
+        cols = np.minimum(np.searchsorted(x_edges, pixels, side='right'), width - 1)
+
+    return colors[rows[:, np.newaxis], cols[np.newaxis, :]]
+
+# map the scalar flux, indexed [y, x], onto a blue-green-red color scale
+def getFluxColors(scalar_flux):
+
+    min_flux = np.min(scalar_flux)
+    flux_range = np.max(scalar_flux) - min_flux
+    delta = scalar_flux - min_flux
+    level = delta / flux_range
+
+    low = level <= 1.0/3.0
+    mid = ~low & (level <= 2.0/3.0)
+    high = ~low & ~mid
+
+    colors = np.zeros(scalar_flux.shape + (3,))
+    colors[low, 1] = 3.0 * delta[low] / flux_range
+    colors[low, 2] = 1.0
+    colors[mid, 0] = 3.0 * delta[mid] / flux_range - 1.0
+    colors[mid, 1] = 1.0
+    colors[mid, 2] = -3.0 * delta[mid] / flux_range + 2.0
+    colors[high, 0] = 1.0
+    colors[high, 1] = -3.0 * delta[high] / flux_range + 3.0
+
+    # convert color to RGB triplet
+    return (255*colors).astype(np.uint8)
 
 def plotMaterial(mesh, spacing, plot_cells):
 
-    bit_size = 500.0
+    bit_length = getBitLength(mesh.width)
 
-    # create image
-    bit_length = round(bit_size / mesh.width)
-    size = int(bit_length * mesh.width)
-    img = Image.new('RGB', (size,size), 'white')
-    draw = ImageDraw.Draw(img)
-
-    # draw cell interior
-    for y in range(mesh.width):
-        for x in range(mesh.width):
+    # fuel red; moderator blue; plotted cells white
+    colors = np.zeros((mesh.width, mesh.width, 3), dtype=np.uint8)
+    fuel = mesh.mat_is_fuel[mesh.material_map]
+    colors[fuel] = (255,0,0)
+    colors[~fuel] = (0,0,255)
 
-            # fuel red; moderator blue
-            if mesh.cells[y*mesh.width+x].material.mat_type == 'fuel':
-                draw.rectangle([x*bit_length, size - y*bit_length - bit_length, (x+1)*bit_length, size - y*bit_length], (255,0,0))
-            else:
-                draw.rectangle([x*bit_length, size - y*bit_length - bit_length, (x+1)*bit_length, size - y*bit_length], (0,0,255))
+    plot_cells = np.asarray(plot_cells, dtype=int)
+    colors.reshape(-1, 3)[plot_cells[(plot_cells >= 0) & (plot_cells < mesh.width**2)]] = (255,255,255)
 
-            if mesh.cells[y*mesh.width+x].id in plot_cells:
-                draw.rectangle([x*bit_length, size - y*bit_length - bit_length, (x+1)*bit_length, size - y*bit_length], (255,255,255))
+    widths = mesh.plotWidths()
+    pixels = rasterize(colors, bit_length, widths)
 
-    # draw horizontal grid lines
-    for y in range(1,mesh.width):
-        draw.line((0, y*bit_length, size,y*bit_length), fill=(0,0,0), width=1)
-
-    # draw vertical grid lines
-    for x in range(1,mesh.width):
-        draw.line((x*bit_length, 0, x*bit_length, size), fill=(0,0,0), width=1)
+    # draw grid lines
+    if widths is None:
+        pixels[bit_length::bit_length, :] = 0
+        pixels[:, bit_length::bit_length] = 0
+    else:
+        size = pixels.shape[0]
+        y_edges, x_edges = (np.cumsum(cell_widths)[:-1] * (size / np.sum(cell_widths)) for cell_widths in widths)
+        pixels[size - np.ceil(y_edges).astype(int), :] = 0
+        pixels[:, np.ceil(x_edges).astype(int)] = 0
 
     # save image
-    img.save('material_' + str(spacing)[2:] + '.png')
+    Image.fromarray(pixels, 'RGB').save('material_' + str(spacing)[2:] + '.png')
 
 def plotScalarFlux(mesh, order, spacing, iteration):
 
-    # create image
-    bit_length = round(500.0 / mesh.width)
-    size = int(bit_length * mesh.width)
-    img = Image.new('RGB', (size,size), 'white')
-    draw = ImageDraw.Draw(img)
+    plotScalarFluxArray(mesh.totalFlux(), order, spacing, iteration, mesh.plotWidths())
 
-    # find max and min flux
-    max_flux = mesh.cells[0].flux
-    min_flux = mesh.cells[0].flux
-    for y in range(mesh.width):
-        for x in range(mesh.width):
-            max_flux = max(mesh.cells[y*mesh.width+x].flux, max_flux)
-            min_flux = min(mesh.cells[y*mesh.width+x].flux, min_flux)
-
-    flux_range = max_flux - min_flux
-
-    # draw flux map
-    for y in range(mesh.width):
-        for x in range(mesh.width):
-            cell = mesh.cells[y*mesh.width+x]
-
-
-            # get color
-            if ((cell.flux-min_flux) / flux_range <= 1.0/3.0):
-                red = 0.0
-                green = 3.0 * (cell.flux-min_flux) / flux_range
-                blue = 1.0
-            elif ((cell.flux-min_flux) / flux_range <= 2.0/3.0):
-                red = 3.0 * (cell.flux-min_flux) / flux_range - 1.0
-                green = 1.0
-                blue = -3.0 * (cell.flux-min_flux) / flux_range + 2.0
-            else:
-                red = 1.0
-                green = -3.0 * (cell.flux-min_flux) / flux_range + 3.0
-                blue = 0.0
-
-            # convert color to RGB triplet
-            red = int(255*red)
-            green = int(255*green)
-            blue = int(255*blue)
-
-            # draw pin and pin power
-            draw.rectangle([x*bit_length, size - y*bit_length - bit_length, (x+1)*bit_length, size - y*bit_length], (red,green,blue))
+# plot a scalar flux map given as an array indexed [y, x], with the
+# (y_widths, x_widths) cell widths of a graded mesh
+def plotScalarFluxArray(scalar_flux, order, spacing, iteration, widths=None):
+
+    bit_length = getBitLength(scalar_flux.shape[0])
+    pixels = rasterize(getFluxColors(scalar_flux), bit_length, widths)
 
     # save image
-    img.save('flux_' + str(spacing)[2:] + '_' + str(int(floor(order/10))) + str(order % 10) + '_' + str(int(floor(iteration/10))) + str(iteration % 10) + '.png')
+    Image.fromarray(pixels, 'RGB').save('flux_' + str(spacing)[2:] + '_' + str(int(floor(order/10))) + str(order % 10) + '_' + str(int(floor(iteration/10))) + str(iteration % 10) + '.png')
+
+
+class ScalarFluxWriter(object):
+
+    # write scalar flux images on a background thread so the solver does not
+    # wait on rasterizing and encoding; at most queue_size snapshots wait to
+    # be written before submit blocks
+    def __init__(self, queue_size=4):
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # write the queued snapshots until the writer is closed
+    def run(self):
+
+        while True:
+            item = self.queue.get()
+
+            try:
+                if item is None:
+                    break
+                if self.error is None:
+                    plotScalarFluxArray(*item)
+            except Exception as error:
+                self.error = error
+            finally:
+                self.queue.task_done()
+
+    # raise an error from the writer thread in the calling thread
+    def checkError(self):
+
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    # queue a copy of the scalar flux to be plotted
+    def submit(self, scalar_flux, order, spacing, iteration, widths=None):
+
+        self.checkError()
+        self.queue.put((np.array(scalar_flux, copy=True), order, spacing, iteration, widths))
+
+    # wait until every queued snapshot is written
+    def flush(self):
+
+        self.queue.join()
+        self.checkError()
+
+    # write the remaining snapshots and stop the writer thread
+    def close(self):
+
+        self.queue.put(None)
+        self.thread.join()
+        self.checkError()
 
 
 def plotAngularFlux(cell, quad):
@@ -1,5 +1,4 @@
 import numpy
-from math import pi, sqrt
 
 class LevelSymmetricQuadrature:
     """A level-symmetric quadrature set
@@ -248,31 +247,129 @@ class LevelSymmetricQuadrature:
                                         1, 0])
 
 
-    def getQuadrature(self, order=4):
+    def getQuadrature(self, order=4, dtype=float):
 
-        # Initialize a dictionary to contain all of the information for
-        # a level-symmetric quadrature of some order (2-24)
-        quad = {}
-        quad['order'] = order
-        quad['num_polar'] = order // 2
-        quad['num_angles'] = 2 * quad['num_polar'] * \
-                             (2 * quad['num_polar'] + 2) // 8 * 4
-        quad['num_angles_per_octant'] = quad['num_angles'] // 4
+        # Quadratures are built once per order and shared, see getQuadrature
+        return getQuadrature(order, dtype)
 
-        quad['mu'] = numpy.zeros(quad['num_angles_per_octant'])
-        quad['eta'] = numpy.zeros(quad['num_angles_per_octant'])
-        quad['xi'] = numpy.zeros(quad['num_angles_per_octant'])
-        quad['weight'] = numpy.zeros(quad['num_angles_per_octant'])
+    def makeQuadrature(self, order):
+
+        # Build a new quadrature of some order (2-24) from the tables
+        num_polar = order // 2
+        num_angles = 2 * num_polar * (2 * num_polar + 2) // 8 * 4
 
         # Loop over all angles in an octant
-        m = 0
-        for i in range(order // 2):
-            for j in range(order // 2 - i):
+        i, j = numpy.array([(i, j) for i in range(num_polar)
+                                   for j in range(num_polar - i)]).T
+        mu = self.att[order][i]
+        eta = self.att[order][j]
+        xi = numpy.sqrt(1.0 - mu**2 - eta**2)
+        weight = self.wtt[order][self.wtt_loc[order][:num_angles // 4]]
+
+        return Quadrature(order, mu, eta, xi, weight)
+
+
+class Quadrature(object):
+    """An immutable quadrature set
+
+        Holds the directions and weights of one octant (mu, eta, xi,
+        weight) and of all four quadrants swept in 2D (mu_all, eta_all,
+        xi_all, weight_all). The four-quadrant arrays are ordered like the
+        cell angular fluxes: the (+mu, +eta), (-mu, +eta), (-mu, -eta) and
+        (+mu, -eta) quadrants follow each other, and mu_sign and eta_sign
+        give the direction signs of each angle. swap gives the index of the
+        octant angle with mu and eta swapped. The real arrays are stored
+        in dtype (float64 by default). All arrays are read-only.
+
+        Values can also be looked up by key (quad['mu']) like the
+        dictionaries returned by earlier versions.
+        """
+
+    # signs of mu and eta in each quadrant block of the angular fluxes
+    quadrant_signs = ((1, 1), (-1, 1), (-1, -1), (1, -1))
+
+    def __init__(self, order, mu, eta, xi, weight, dtype=float):
+
+        fields = {}
+        fields['order'] = order
+        fields['num_polar'] = order // 2
+        fields['num_angles'] = 4 * len(mu)
+        fields['num_angles_per_octant'] = len(mu)
+
+        fields['mu'] = mu
+        fields['eta'] = eta
+        fields['xi'] = xi
+        fields['weight'] = weight
+
+        signs = numpy.repeat(numpy.array(self.quadrant_signs, dtype=float),
+                             len(mu), axis=0)
+        fields['mu_sign'] = signs[:, 0]
+        fields['eta_sign'] = signs[:, 1]
+        fields['mu_all'] = fields['mu_sign'] * numpy.tile(mu, 4)
+        fields['eta_all'] = fields['eta_sign'] * numpy.tile(eta, 4)
+        fields['xi_all'] = numpy.tile(xi, 4)
+        fields['weight_all'] = numpy.tile(weight, 4)
+
+        # index of the octant angle with mu and eta swapped, the image of
+        # each angle under reflection in the diagonal
+        fields['swap'] = numpy.array([numpy.flatnonzero(numpy.isclose(mu, eta[k]) & numpy.isclose(eta, mu[k]))[0]
+                                      for k in range(len(mu))])
+
+        for key, value in fields.items():
+            if isinstance(value, numpy.ndarray):
+                value = numpy.array(value, dtype=value.dtype if key == 'swap' else dtype)
+                value.flags.writeable = False
+            object.__setattr__(self, key, value)
+
+        object.__setattr__(self, '_keys', tuple(fields))
+
+    def __setattr__(self, key, value):
+
+        raise AttributeError('quadrature sets are read-only')
+
+    def __delattr__(self, key):
+
+        raise AttributeError('quadrature sets are read-only')
+
+    def __getitem__(self, key):
+
+        if key not in self._keys:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key):
+
+        return key in self._keys
+
+    def keys(self):
+
+        return self._keys
+
+
+# Module-level caches of the quadrature tables and of the quadrature sets
+# built from them, keyed by order and dtype
+_tables = None
+_quadratures = {}
+
+
+def getQuadrature(order=4, dtype=float):
+    """Get the shared, read-only level-symmetric quadrature of some order
+
+        Sets in a dtype other than float64 are rounded from the float64 set.
+        """
+
+    global _tables
 
-                quad['mu'][m] = self.att[order][i]
-                quad['eta'][m] = self.att[order][j]
-                quad['xi'][m] = sqrt(1.0 - quad['mu'][m]**2 - quad['eta'][m]**2)
-                quad['weight'][m] = self.wtt[order][self.wtt_loc[order][m]]
-                m += 1
+    dtype = numpy.dtype(dtype)
+    if (order, dtype) not in _quadratures:
+        if dtype != numpy.float64:
+            quad = getQuadrature(order)
+            _quadratures[order, dtype] = Quadrature(order, quad.mu, quad.eta, quad.xi, quad.weight, dtype)
+        else:
+            if _tables is None:
+                _tables = LevelSymmetricQuadrature()
+            if order not in _tables.att:
+                raise ValueError('no level-symmetric quadrature of order ' + str(order))
+            _quadratures[order, dtype] = _tables.makeQuadrature(order)
 
-        return quad
+    return _quadratures[order, dtype]
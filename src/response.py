@@ -0,0 +1,203 @@
+import numpy as np
+import sweeper
+
+# Direct solve of the reflective boundary problem with a response matrix.
+#
+# With a fixed source and no scattering a sweep of all four quadrants from
+# the same incoming boundary fluxes x (the mesh ang_flux edge buffers) gives
+# the outgoing fluxes R x + s, where the response R only depends on the
+# cross sections, the cells and the quadrature and s is the outgoing flux
+# of the source alone. Reflecting them (P, see Mesh.reflectAll) gives the
+# next incoming fluxes g = P (R x + s), so the reflective fixed point is
+#
+#   x* = x + (I - P R)^-1 (g - x)
+#
+# for any x and the g of its sweep. Every angle of a quadrant is swept on
+# its own, and the reflections only couple an angle with its mirror images
+# in the other quadrants (the same angle of each buffer), so the problem
+# splits into one for each angle of a quadrant (and group). R is found by
+# sweeping unit incoming fluxes on each edge cell of a mesh of width W, 2 W
+# of them swept together along a batch axis.
+#
+# A quadrant only responds to its own 2 W incoming fluxes, and P sends the
+# outgoing fluxes of the (+mu, +eta) and (-mu, -eta) quadrants (the first
+# pair) to the incoming fluxes of the other two (the second pair) and back.
+# With A and B the responses of the second pair reflected into the first
+# and the other way round, the 8 W x 8 W system splits into
+#
+#   (I - A B) y1 = r1 + A r2,   y2 = r2 + B y1
+#
+# for the residual r = g - x of each pair, and only the 4 W x 4 W matrix
+# I - A B of each angle is inverted, by one batched LU solve.
+#
+# On a uniform mesh I - A B is singular: edge fluxes of alternating sign
+# with mu_coef x + eta_coef y = 0 in every cell (the checkerboard mode of
+# diamond difference) leave every cell flux zero and come back unchanged
+# after the reflections. The mode is found in the span of those patterns,
+# and n n^T is added to I - A B for its unit vector n, which leaves the
+# mode out of the step (the residuals never excite it and it never changes
+# a tally).
+#
+# Building the response takes 2 W sweeps of unit fluxes (batched) and
+# O(nq (4 W)^3) work for the inverse, against the few tens of sweeps plain
+# iteration needs, so it only pays on small meshes. Meshes whose inverted
+# matrices would hold more than MAX_ENTRIES entries (16 W^2 nq for each
+# group) fall back to plain iteration (see useResponse).
+
+# the buffer each ang_flux buffer is reflected from (see Mesh.reflectAll)
+REFLECTIONS = [2, 3, 0, 1]
+
+# the most entries of the inverted matrices of one group the response
+# matrix is built for, about where building it stops paying off
+MAX_ENTRIES = 1500000
+
+
+# check whether the response matrix is worth building for a mesh of the
+# given width and number of angles per quadrant (see MAX_ENTRIES)
+def useResponse(width, nq):
+
+    return 16 * width**2 * nq <= MAX_ENTRIES
+
+
+class ResponseMatrix(object):
+
+    # quadrants    the quadrants to sweep (see discrete_ordinates.QUADRANTS)
+    # sweep_map    denominator index of each cell, indexed [y, x]
+    # coefficients the (mu_coef, eta_coef, denom) of the mesh (see
+    #              Mesh.sweepCoefficients), whose dtype the response is
+    #              built and solved in
+    # batch        the batch axes of the mesh (the group axis, if any)
+    def __init__(self, quadrants, sweep_map, coefficients, batch=()):
+
+        mu_coef, eta_coef, denom = coefficients
+        width = sweep_map.shape[0]
+        nq = denom.shape[-1]
+        dtype = denom.dtype
+        self.width = width
+        self.batch = tuple(batch)
+        self.nq = nq
+
+        # unit incoming fluxes on each row of the x buffers (batch entries
+        # 0 to W - 1) and each column of the y buffers (W to 2 W - 1)
+        cells = np.arange(width)
+        ang_flux = np.zeros((4, width, 2*width) + self.batch + (2*nq,), dtype=dtype)
+        ang_flux[0::2, cells, cells] = 1.0
+        ang_flux[1::2, cells, width + cells] = 1.0
+
+        # the unit fluxes are swept with no source, keeping only one sum
+        # over the angles of each cell
+        source = np.broadcast_to(np.zeros((1, 1, 1) + self.batch, dtype=dtype),
+                                 (width, width, 2*width) + self.batch)
+        cell_flux = np.empty((width, width, 2*width) + self.batch + (1,))
+        weights = np.ones(nq)
+        views = (mu_coef[:, np.newaxis], eta_coef[:, np.newaxis]) if np.ndim(mu_coef) > 1 else (mu_coef, eta_coef)
+
+        for quadrant in quadrants:
+            sweeper.sweepWavefront(*sweeper.quadrantViews(ang_flux, cell_flux, sweep_map, source, quadrant, slot=0),
+                                   *sweeper.coefficientViews(denom[:, np.newaxis], *views, quadrant),
+                                   weights=weights)
+
+        # the incoming (and outgoing) fluxes of each quadrant, as indices
+        # into the boundary vectors (see vectors), and of each pair
+        self.inputs = {}
+        for quadrant in quadrants:
+            x_edge, x_off, y_edge, y_off = quadrant[2:6]
+            self.inputs[quadrant] = np.concatenate([(x_edge*width + cells)*2 + x_off,
+                                                    (y_edge*width + cells)*2 + y_off])
+        first = [quadrant for quadrant in quadrants if quadrant[0] == quadrant[1]]
+        second = [quadrant for quadrant in quadrants if quadrant[0] != quadrant[1]]
+        self.first = np.concatenate([self.inputs[quadrant] for quadrant in first])
+        self.second = np.concatenate([self.inputs[quadrant] for quadrant in second])
+
+        # the response of each pair to its own incoming fluxes, indexed
+        # [..., out, in] with the batch and angle axes first, from the
+        # outgoing fluxes indexed [(buffer, cell, offset), unit input, ...]
+        out = np.moveaxis(ang_flux.reshape((4, width, 2*width) + self.batch + (2, nq)), -2, 2)
+        out = out.reshape((8*width, 2*width) + self.batch + (nq,))
+        out = np.moveaxis(out, (0, 1), (-2, -1))
+
+        def pairResponse(pair):
+            response = np.zeros(out.shape[:-2] + (4*width, 4*width), dtype=dtype)
+            for k, quadrant in enumerate(pair):
+                block = slice(2*k*width, 2*(k + 1)*width)
+                response[..., block, block] = out[..., self.inputs[quadrant], :]
+            return response
+
+        # the reflections take each incoming flux of one pair from an
+        # outgoing flux of the other
+        position = np.empty(8*width, dtype=int)
+        position[self.first] = np.arange(4*width)
+        position[self.second] = np.arange(4*width)
+        self.A = pairResponse(second)[..., position[self.reflect(self.first)], :]
+        self.B = pairResponse(first)[..., position[self.reflect(self.second)], :]
+
+        matrix = np.eye(4*width, dtype=dtype) - self.A @ self.B
+        matrix += self.nullProjector(matrix, mu_coef, eta_coef, first)
+        self.inverse = np.linalg.inv(matrix)
+
+    # get the boundary vector indices the given incoming fluxes are
+    # reflected from
+    def reflect(self, indices):
+
+        buffer, rest = np.divmod(indices, 2*self.width)
+        return np.array(REFLECTIONS)[buffer]*2*self.width + rest
+
+    # get n n^T for the unit null vector n of I - A B of each angle (and
+    # group), or zero where it has none. The null vector lies in the span
+    # of the checkerboard patterns of the x and y incoming fluxes of the
+    # quadrants of the first pair (see the module comment).
+    def nullProjector(self, matrix, mu_coef, eta_coef, first):
+
+        width = self.width
+        signs = (-1.0) ** np.arange(width)
+        if np.ndim(mu_coef) > 1:
+            mu_coef = mu_coef.reshape(width, -1)
+            eta_coef = eta_coef.reshape(width, -1)
+        else:
+            mu_coef = np.broadcast_to(mu_coef, (width, self.nq))
+            eta_coef = np.broadcast_to(eta_coef, (width, self.nq))
+
+        # one pattern for each edge of each quadrant of the pair, indexed
+        # [angle, 4 W, pattern]
+        patterns = np.zeros((self.nq, 4*width, 4), dtype=matrix.dtype)
+        for k in range(len(first)):
+            patterns[:, 2*k*width:(2*k + 1)*width, 2*k] = (signs[:, np.newaxis] * eta_coef).T
+            patterns[:, (2*k + 1)*width:2*(k + 1)*width, 2*k + 1] = (signs[:, np.newaxis] * mu_coef).T
+        patterns /= np.linalg.norm(patterns, axis=-2, keepdims=True)
+
+        # the combination of the patterns I - A B leaves (nearly) zero
+        u, s, vh = np.linalg.svd(matrix @ patterns, full_matrices=False)
+        null = patterns @ vh[..., -1, :, np.newaxis]
+        null /= np.linalg.norm(null, axis=-2, keepdims=True)
+        singular = s[..., -1] < np.sqrt(np.finfo(matrix.dtype).eps)
+
+        return np.where(singular[..., np.newaxis, np.newaxis], null * np.swapaxes(null, -1, -2), 0.0)
+
+    # get the fixed point of the reflective boundary iteration from the
+    # incoming boundary fluxes x of a sweep and the reflected outgoing
+    # fluxes g it gave (both shaped as the mesh ang_flux)
+    def update(self, x, g):
+
+        residual = self.vectors(g - x)
+        r1 = residual[..., self.first, :]
+        r2 = residual[..., self.second, :]
+        y1 = self.inverse @ (r1 + self.A @ r2)
+        step = np.empty_like(residual)
+        step[..., self.first, :] = y1
+        step[..., self.second, :] = r2 + self.B @ y1
+
+        return x + self.fluxes(step)
+
+    # get the boundary fluxes of each angle (and group) as column vectors
+    # indexed [..., angle, (buffer, cell, offset), 1]
+    def vectors(self, ang_flux):
+
+        ang_flux = ang_flux.reshape((4, self.width) + self.batch + (2, self.nq))
+        vectors = np.moveaxis(ang_flux, -2, 2).reshape((8*self.width,) + self.batch + (self.nq,))
+        return np.moveaxis(vectors, 0, -1)[..., np.newaxis]
+
+    # get the boundary fluxes shaped as the mesh ang_flux from their vectors
+    def fluxes(self, vectors):
+
+        ang_flux = np.moveaxis(vectors[..., 0], -1, 0).reshape((4, self.width, 2) + self.batch + (self.nq,))
+        return np.moveaxis(ang_flux, 2, -2).reshape((4, self.width) + self.batch + (2*self.nq,))
@@ -12,18 +12,12 @@ num_iter = 50
 geom = 'square'
 plot_flux = False
 
+# keep only the scalar flux and the angular fluxes of the plot cells
+low_memory = False
+
 for spacing in spacings:
     for order in orders:
 
-        # create mesh
-        mesh = Mesh(order=order, mesh_size=spacing, tolerance=tol, geometry=geom)
-
-        print('CASE - mesh_size {} order {} geometry {}'.format(spacing, order, geom))
-
-        # create fuel and moderator materials
-        fuel = Material('fuel', 100.0, 1.0/(4.0*np.pi))
-        moderator = Material('moderator', 0.25, 0.0)
-
         cell_width = int(1.26 / spacing)
         fuel_width = int(0.70 / spacing)
         # 1, 2, 3, 4, 5
@@ -33,6 +27,16 @@ for spacing in spacings:
                       int((cell_width/2.0)*cell_width+cell_width/2.0) + fuel_width/2 -1,
                       int((cell_width/2.0 + 1)*cell_width - 1)]
 
+        # create mesh
+        mesh = Mesh(order=order, mesh_size=spacing, tolerance=tol, geometry=geom, plot_policy='final',
+                    low_memory=low_memory, probe_cells=plot_cells if plot_flux else None)
+
+        print('CASE - mesh_size {} order {} geometry {}'.format(spacing, order, geom))
+
+        # create fuel and moderator materials
+        fuel = Material('fuel', 100.0, 1.0/(4.0*np.pi))
+        moderator = Material('moderator', 0.25, 0.0)
+
         # assign fuel and moderator materials to mesh
         mesh.setFuel(fuel)
         mesh.setModerator(moderator)
@@ -54,9 +58,9 @@ for spacing in spacings:
         print('Ran Sn solver with {} angles in {:.2f} seconds'.format(order*(order+2)//2, stop-start))
 
         if plot_flux:
-            quad = quadrature.LevelSymmetricQuadrature().getQuadrature(sn_order)
+            quad = quadrature.getQuadrature(order)
             for i in plot_cells:
                 print('plotting angular flux for cell ' + str(i))
-                pttr.plotAngularFlux(mesh.cells[i], quad)
+                plotter.plotAngularFlux(mesh.cells[i], quad)
 
         print('----------------------------------------------------------------------')
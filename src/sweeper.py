@@ -0,0 +1,217 @@
+import numpy as np
+
+# Wavefront sweep kernels for the diamond difference Sn equations.
+#
+# The kernels work in the frame of a sweep in the positive x and y
+# directions: callers pass views of the mesh arrays that are reversed along
+# the axes swept in the negative direction. Cell (y, x) only depends on
+# its left (y, x-1) and bottom (y-1, x) neighbours, so all cells on an
+# anti-diagonal y + x = k are independent and are solved together for all
+# angles of the quadrant.
+
+
+# cache of anti-diagonal cell indices keyed by the (rows, columns) shape
+_diagonals = {}
+
+
+# get the (y, x) index arrays of each anti-diagonal of a rows x columns block
+def getDiagonals(rows, cols):
+
+    if (rows, cols) not in _diagonals:
+        diagonals = []
+        for k in range(rows + cols - 1):
+            ys = np.arange(max(0, k - cols + 1), min(k, rows - 1) + 1)
+            diagonals.append((ys, k - ys))
+        _diagonals[(rows, cols)] = diagonals
+
+    return _diagonals[(rows, cols)]
+
+
+# get the views of the edge fluxes, cell angular fluxes, material map and
+# cell sources used to sweep a quadrant (see QUADRANTS in
+# discrete_ordinates) over the angles [start, stop) of the quadrant, in the
+# frame of the kernels. The flux and source arrays may have batch axes
+# (e.g. energy groups) between the mesh axes and the angle axis; the
+# material map is shared by the whole batch. Only the cells from row
+# first[0] and column first[1] on are swept. If a slot is given the cell
+# view is the single column slot of cell_ang_flux, which then holds the
+# weighted angular sums of the quadrants (see the weights of sweepWavefront).
+def quadrantViews(ang_flux, cell_ang_flux, material_map, cell_source, quadrant, start=0, stop=None,
+                  first=(0, 0), slot=None):
+
+    nq = ang_flux.shape[-1]//2
+    if stop is None:
+        stop = nq
+    x_edge, x_off, y_edge, y_off, block = quadrant[2:]
+    y0, x0 = first
+
+    # reverse the axes swept in the negative direction so the kernel
+    # always sweeps from the bottom left corner
+    ys = slice(None, None, quadrant[1])
+    xs = slice(None, None, quadrant[0])
+
+    if slot is None:
+        cells = slice(block*nq+start, block*nq+stop)
+    else:
+        cells = slice(slot, slot + 1)
+
+    return (ang_flux[x_edge, y0:, ..., x_off*nq+start:x_off*nq+stop][ys],
+            ang_flux[y_edge, x0:, ..., y_off*nq+start:y_off*nq+stop][xs],
+            cell_ang_flux[y0:, x0:, ..., cells][ys, xs],
+            material_map[y0:, x0:][ys, xs],
+            cell_source[y0:, x0:][ys, xs])
+
+
+# get the views of the diamond difference denominators and streaming
+# coefficients used to sweep the angles [start, stop) of a quadrant (see
+# quadrantViews). On a graded mesh the streaming coefficients are given for
+# each column (mu) and row (eta) and are cut and reversed like the cells.
+def coefficientViews(denom, mu_coef, eta_coef, quadrant, start=0, stop=None, first=(0, 0)):
+
+    if np.ndim(mu_coef) > 1:
+        y0, x0 = first
+        mu_coef = mu_coef[x0:][::quadrant[0]]
+        eta_coef = eta_coef[y0:][::quadrant[1]]
+
+    return denom[..., start:stop], mu_coef[..., start:stop], eta_coef[..., start:stop]
+
+
+# get the views of the probe map and probe angular fluxes used to sweep the
+# angles [start, stop) of a quadrant (see quadrantViews)
+def probeViews(probe_map, probe_flux, quadrant, start=0, stop=None, first=(0, 0)):
+
+    nq = probe_flux.shape[-1]//4
+    if stop is None:
+        stop = nq
+    block = quadrant[6]
+    y0, x0 = first
+
+    return (probe_map[y0:, x0:][::quadrant[1], ::quadrant[0]],
+            probe_flux[..., block*nq+start:block*nq+stop])
+
+
+# sweep one quadrant over the mesh one anti-diagonal at a time
+#
+#   x_flux       edge fluxes moving in x, indexed [y, ..., angle]
+#   y_flux       edge fluxes moving in y, indexed [x, ..., angle]
+#   cell_flux    cell centered angular fluxes, indexed [y, x, ..., angle]
+#   material_map denominator (material) index of each cell, indexed [y, x]
+#   source       angular source of each cell, indexed [y, x, ...]
+#   denom        diamond difference denominator, indexed [material, ..., angle]
+#   mu_coef      2 mu / h for each angle, or on a graded mesh 2 mu / h_x for
+#                each column, indexed [x, ..., angle]
+#   eta_coef     2 eta / h for each angle, or on a graded mesh 2 eta / h_y
+#                for each row, indexed [y, ..., angle]
+#   weights      optional quadrature weights of the angles; cell_flux then
+#                gets the weighted sum of the angular fluxes of each cell,
+#                indexed [y, x, ..., 1], instead of the angular fluxes
+#   probe_map    optional probe index of each cell (-1 for none), indexed
+#                [y, x]; the angular fluxes of the probe cells are stored in
+#   probe_flux   indexed [probe, ..., angle]
+#
+# The batch axes (...) are swept together, so every group of a
+# multigroup problem is solved in the same pass over the diagonals.
+def sweepWavefront(x_flux, y_flux, cell_flux, material_map, source, denom,
+                   mu_coef, eta_coef, weights=None, probe_map=None, probe_flux=None):
+
+    rows, cols = material_map.shape
+    graded = np.ndim(mu_coef) > 1
+
+    for ys, xs in getDiagonals(rows, cols):
+
+        x_in = x_flux[ys]
+        y_in = y_flux[xs]
+        mat = material_map[ys, xs]
+        mu = mu_coef[xs] if graded else mu_coef
+        eta = eta_coef[ys] if graded else eta_coef
+
+        # compute cell centered fluxes
+        psi = (source[ys, xs][..., np.newaxis] + mu * x_in + eta * y_in) / denom[mat]
+        if weights is None:
+            cell_flux[ys, xs] = psi
+        else:
+            cell_flux[ys, xs] = np.dot(psi, weights)[..., np.newaxis]
+
+        if probe_map is not None:
+            probes = probe_map[ys, xs]
+            hits = probes >= 0
+            if hits.any():
+                probe_flux[probes[hits]] = psi[hits]
+
+        # sweep across the cells in x and y
+        x_flux[ys] = 2 * psi - x_in
+        y_flux[xs] = 2 * psi - y_in
+
+
+# sweep one quadrant one cell at a time, updating all of its angles at once
+# (same arguments as sweepWavefront)
+def sweepAngles(x_flux, y_flux, cell_flux, material_map, source, denom, mu_coef, eta_coef,
+                weights=None, probe_map=None, probe_flux=None):
+
+    rows, cols = material_map.shape
+    graded = np.ndim(mu_coef) > 1
+
+    for y in range(rows):
+        x_in = x_flux[y]
+        eta = eta_coef[y] if graded else eta_coef
+        for x in range(cols):
+
+            mat = material_map[y, x]
+            y_in = y_flux[x]
+            mu = mu_coef[x] if graded else mu_coef
+
+            # compute cell centered flux
+            psi = (source[y, x][..., np.newaxis] + mu * x_in + eta * y_in) / denom[mat]
+            if weights is None:
+                cell_flux[y, x] = psi
+            else:
+                cell_flux[y, x] = np.dot(psi, weights)[..., np.newaxis]
+
+            if probe_map is not None and probe_map[y, x] >= 0:
+                probe_flux[probe_map[y, x]] = psi
+
+            # sweep across the cell in x and y
+            x_in[...] = 2 * psi - x_in
+            y_in[...] = 2 * psi - y_in
+
+
+# sweep one quadrant one cell and one angle at a time (same arguments as
+# sweepWavefront); this is the reference implementation of the kernels
+def sweepCells(x_flux, y_flux, cell_flux, material_map, source, denom, mu_coef, eta_coef,
+               weights=None, probe_map=None, probe_flux=None):
+
+    rows, cols = material_map.shape
+    graded = np.ndim(mu_coef) > 1
+
+    for y in range(rows):
+        for x in range(cols):
+            mu = mu_coef[x].ravel() if graded else mu_coef
+            eta = eta_coef[y].ravel() if graded else eta_coef
+
+            for batch in np.ndindex(source.shape[2:]):
+
+                if weights is None:
+                    ang_flux = cell_flux[(y, x) + batch]
+                else:
+                    ang_flux = np.empty(len(mu), dtype=x_flux.dtype)
+                cell_source = source[(y, x) + batch]
+                cell_denom = denom[(material_map[y, x],) + batch]
+                x_in = x_flux[(y,) + batch]
+                y_in = y_flux[(x,) + batch]
+
+                for angle in range(len(mu)):
+
+                    # compute cell centered flux
+                    ang_flux[angle] = (cell_source + mu[angle] * x_in[angle] +
+                                       eta[angle] * y_in[angle]) / cell_denom[angle]
+
+                    # sweep across the cell in x
+                    x_in[angle] = 2 * ang_flux[angle] - x_in[angle]
+
+                    # sweep across the cell in y
+                    y_in[angle] = 2 * ang_flux[angle] - y_in[angle]
+
+                if weights is not None:
+                    cell_flux[(y, x) + batch][0] = np.dot(ang_flux, weights)
+                if probe_map is not None and probe_map[y, x] >= 0:
+                    probe_flux[(probe_map[y, x],) + batch] = ang_flux
@@ -0,0 +1,76 @@
+import pytest
+import campaign
+from discrete_ordinates import SnIteration
+
+# results that do not depend on how long the solve took
+RESULTS = ['RR_isolated', 'RR_lattice', 'dancoff', 'flux_ratio', 'converged', 'num_iterations', 'stopped']
+
+
+# small square and circle pin cells
+def makeCases():
+
+    return campaign.makeCases([2, 4], [0.09], geometries=('square', 'circle'), tolerance=1e-6, num_iter=200)
+
+
+def test_cached_results_match_a_fresh_run(tmp_path, monkeypatch):
+
+    cases = makeCases()
+    first = campaign.runCampaign(cases, cache_dir=str(tmp_path), num_workers=1, verbose=False)
+
+    # the second run must take every case from the cache
+    def runCases(todo):
+        raise AssertionError('cached case solved again')
+    monkeypatch.setattr(campaign, '_runCases', runCases)
+    cached = campaign.runCampaign(cases, cache_dir=str(tmp_path), num_workers=1, verbose=False)
+
+    for case, first_results, cached_results in zip(cases, first, cached):
+        fresh = campaign.runCase(case)
+        for name in RESULTS:
+            assert cached_results[name] == first_results[name] == fresh[name]
+
+
+# iterations of a reflective solve with the given eps, converged at the
+# last one if converged is set
+def iterations(eps, converged=False):
+
+    for k, value in enumerate(eps):
+        yield SnIteration(k, True, value, converged and k == len(eps) - 1, None)
+
+
+@pytest.mark.parametrize('eps, rules, stopped, last', [
+    # no new low for two iterations
+    ([1.0, 0.5, 0.6, 0.55, 0.4], {'stall_iterations': 2}, 'stalled', 3),
+    ([1.0, 0.5, 0.6, 0.4, 0.45, 0.3], {'stall_iterations': 2}, None, 5),
+    # three times the lowest eps
+    ([1.0, 0.2, 0.5, 0.61, 0.1], {'divergence': 3.0}, 'diverged', 3),
+    ([1.0, 0.2, 0.5, 0.6, 0.1], {'divergence': 3.0}, None, 4),
+    ([1.0, 0.5, 0.6, 0.7], {}, None, 3)])
+def test_watch_solve_rules(eps, rules, stopped, last):
+
+    seen = []
+    def watched():
+        for state in iterations(eps):
+            seen.append(state.iteration)
+            yield state
+
+    assert campaign.watchSolve(watched(), **rules) == stopped
+    assert seen[-1] == last
+
+
+def test_watch_solve_ends_on_convergence():
+
+    assert campaign.watchSolve(iterations([1.0, 0.5, 0.9, 0.95], converged=True), stall_iterations=2) is None
+
+
+# eps of the run_script pin grows at the second iteration (the first
+# repeats the vacuum sweep), so either rule stops the solve there
+@pytest.mark.parametrize('rules, stopped', [({'stall_iterations': 1}, 'stalled'), ({'divergence': 1.2}, 'diverged')])
+def test_stopped_solve_is_recorded(tmp_path, rules, stopped):
+
+    case = campaign.makeCase(4, 0.09, tolerance=1e-6, num_iter=200, **rules)
+    results = campaign.runCampaign([case], cache_dir=str(tmp_path), num_workers=1, verbose=False)[0]
+
+    assert results['stopped'] == stopped
+    assert not results['converged']
+    assert results['num_iterations'] == 2
+    assert campaign.ResultCache(str(tmp_path)).get(case)['stopped'] == stopped
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+import geometry as geom
+
+PITCH = 1.26
+
+
+# the material map of a one region pin on a uniform mesh of the given width
+# or on a graded mesh with the same, uniform, cell widths
+def pinMap(geometry, width, size, graded):
+
+    mesh_size = PITCH / width
+    widths = (np.full(width, mesh_size), np.full(width, mesh_size)) if graded else None
+
+    return geom.makeMaterialMap(geometry, width, mesh_size, PITCH, [(size, 1)], 0, widths=widths)
+
+
+@pytest.mark.parametrize('geometry', ['square', 'circle'])
+@pytest.mark.parametrize('width', [7, 10, 13, 14, 20, 21])
+@pytest.mark.parametrize('size', [0.5, 0.7, 0.82, 0.95])
+def test_uniform_widths_give_the_uniform_map(geometry, width, size):
+
+    assert np.array_equal(pinMap(geometry, width, size, True), pinMap(geometry, width, size, False))
+
+
+@pytest.mark.parametrize('width', [13, 14, 20, 21])
+def test_square_is_centred(width):
+
+    material_map = pinMap('square', width, 0.7, False)
+
+    assert np.array_equal(material_map, material_map[::-1])
+    assert np.array_equal(material_map, material_map[:, ::-1])
+    assert np.array_equal(material_map, material_map.T)
+
+
+def test_square_is_rounded_down_to_whole_cells():
+
+    # 0.7 / 0.09 = 7.8 cells across, so 3 whole cells on each side
+    assert np.sum(pinMap('square', 14, 0.7, False)) == 36
+    assert np.sum(pinMap('square', 14, 0.7, True)) == 36
+
+
+# the map of a pin with the given regions on the graded mesh of gradedWidths
+def gradedMap(geometry, regions, fine, coarse):
+
+    widths = geom.gradedWidths(PITCH, [size for size, material in regions], fine, coarse)
+
+    return widths, geom.makeMaterialMap(geometry, len(widths), fine, PITCH, regions, 0, widths=(widths, widths))
+
+
+@pytest.mark.parametrize('geometry', ['square', 'circle'])
+@pytest.mark.parametrize('regions', [[(0.7, 1)], [(0.82, 2), (0.7, 1)], [(0.95, 2), (0.5, 1)]])
+@pytest.mark.parametrize('fine, coarse', [(0.01, 0.08), (0.005, 0.05), (0.02, 0.1)])
+def test_graded_map_is_symmetric(geometry, regions, fine, coarse):
+
+    widths, material_map = gradedMap(geometry, regions, fine, coarse)
+
+    assert np.array_equal(material_map, material_map[::-1])
+    assert np.array_equal(material_map, material_map[:, ::-1])
+    assert np.array_equal(material_map, material_map.T)
+
+
+@pytest.mark.parametrize('regions', [[(0.7, 1)], [(0.82, 2), (0.7, 1)], [(0.95, 2), (0.5, 1)]])
+@pytest.mark.parametrize('fine, coarse', [(0.01, 0.08), (0.005, 0.05), (0.02, 0.1)])
+def test_graded_square_fills_its_region(regions, fine, coarse):
+
+    # the graded cell edges fall on every region boundary, so each square
+    # region covers exactly its size
+    widths, material_map = gradedMap('square', regions, fine, coarse)
+    for size, material in regions:
+        inside = geom.regionMask('square', len(widths), fine, PITCH, size, (widths, widths))
+        assert np.sum(widths[np.any(inside, axis=0)]) == pytest.approx(size)
+
+
+def test_graded_square_counts_the_boundary_cells():
+
+    # 20 graded cells across the 0.7 cm fuel
+    widths, material_map = gradedMap('square', [(0.7, 1)], 0.01, 0.08)
+
+    assert np.sum(material_map == 1) == 400
@@ -0,0 +1,341 @@
+import numpy as np
+import pytest
+from discrete_ordinates import Mesh
+from batch import VariantBatch
+from lattice import Lattice
+import response
+import checkpoint
+from material import Material
+import geometry as geom
+
+# the run_script pin cell on a small mesh, solved tightly enough that
+# solves taking different iteration paths agree to DANCOFF_TOL
+MESH_SIZE   = 0.09
+ORDER       = 4
+TOLERANCE   = 1e-8
+NUM_ITER    = 1000
+DANCOFF_TOL = 1e-6
+
+
+# create the pin cell mesh with the given Mesh options and the run_script
+# materials, or the given fuel and moderator
+def makeMesh(mesh_size=MESH_SIZE, fuel=None, moderator=None, **options):
+
+    mesh = Mesh(mesh_size, ORDER, TOLERANCE, plot_policy='none', verbose=False, **options)
+    mesh.setFuel(fuel or Material('fuel', 100.0, 1.0/(4.0*np.pi)))
+    mesh.setModerator(moderator or Material('moderator', 0.25, 0.0))
+    mesh.makeMeshMaterials()
+
+    return mesh
+
+
+# solve the vacuum and reflective problems of a mesh
+def solve(mesh):
+
+    try:
+        mesh.solveSn(False, 1)
+        mesh.solveSn(True, NUM_ITER)
+    finally:
+        mesh.close()
+    assert mesh.converged
+
+    return mesh
+
+
+# the serial cell by cell sweep every other solve is checked against
+@pytest.fixture(scope='module')
+def baseline():
+
+    return solve(makeMesh(sweep='cell'))
+
+
+@pytest.mark.parametrize('sweep', ['angle', 'wavefront'])
+def test_sweeps_match_baseline(baseline, sweep):
+
+    mesh = solve(makeMesh(sweep=sweep))
+
+    assert mesh.dancoff == pytest.approx(baseline.dancoff, abs=DANCOFF_TOL)
+    assert mesh.num_iterations == baseline.num_iterations
+
+
+@pytest.mark.parametrize('parallel', ['angle', 'quadrant'])
+def test_parallel_sweeps_match_baseline(baseline, parallel):
+
+    mesh = solve(makeMesh(num_workers=2, parallel=parallel))
+
+    assert mesh.dancoff == pytest.approx(baseline.dancoff, abs=DANCOFF_TOL)
+
+
+def test_checkpoint_restart_matches_baseline(baseline, tmp_path):
+
+    path = str(tmp_path / 'checkpoint')
+    mesh = makeMesh(checkpoint_path=path, checkpoint_every=5)
+    mesh.solveSn(False, 1)
+    mesh.solveSn(True, 10)
+    mesh.close()
+    assert not mesh.converged
+
+    # a new mesh picks the solve up from the last checkpoint
+    mesh = makeMesh()
+    mesh.solveSn(True, NUM_ITER, restart=path)
+    mesh.close()
+
+    assert mesh.converged
+    assert mesh.dancoff == pytest.approx(baseline.dancoff, abs=DANCOFF_TOL)
+    assert mesh.num_iterations == baseline.num_iterations
+
+
+# (0.0969 cm cells give an odd width of 13, with a cell across the centre)
+@pytest.mark.parametrize('symmetry', ['quarter', 'eighth'])
+@pytest.mark.parametrize('mesh_size', [MESH_SIZE, 0.0969])
+def test_symmetry_matches_full_mesh(symmetry, mesh_size):
+
+    full = solve(makeMesh(mesh_size))
+    mesh = solve(makeMesh(mesh_size, symmetry=symmetry))
+
+    assert mesh.dancoff == pytest.approx(full.dancoff, abs=DANCOFF_TOL)
+    assert mesh.flux_ratio == pytest.approx(full.flux_ratio, rel=DANCOFF_TOL)
+
+
+@pytest.mark.parametrize('geometry', ['square', 'circle'])
+def test_uniform_graded_mesh_matches_uniform_mesh(geometry):
+
+    uniform = solve(makeMesh(geometry=geometry))
+    widths = np.full(uniform.width, MESH_SIZE)
+    mesh = solve(makeMesh(geometry=geometry, x_widths=widths, y_widths=widths))
+
+    assert np.array_equal(mesh.material_map, uniform.material_map)
+    assert mesh.dancoff == pytest.approx(uniform.dancoff, abs=DANCOFF_TOL)
+
+
+def test_graded_mesh_matches_fine_uniform_mesh():
+
+    # a 0.72 cm square fuel in a 1.28 cm pitch falls on the edges of 0.02 cm
+    # cells; the graded mesh has 30 cells against 64 and the two agree to
+    # within the spatial discretization error of the coarse moderator cells
+    widths = geom.gradedWidths(1.28, [0.72], 0.02, 0.08)
+    uniform = solve(makeMesh(0.02, pitch=1.28, fuel_diameter=0.72, acceleration='anderson'))
+    mesh = solve(makeMesh(0.02, pitch=1.28, fuel_diameter=0.72, x_widths=widths, y_widths=widths))
+
+    assert mesh.width < uniform.width / 2
+    assert mesh.dancoff == pytest.approx(uniform.dancoff, abs=1e-3)
+
+
+def test_graded_mesh_defaults_to_anderson():
+
+    widths = geom.gradedWidths(1.26, [0.7], 0.02, 0.08)
+
+    assert makeMesh(x_widths=widths, y_widths=widths).acceleration == 'anderson'
+    assert makeMesh(x_widths=widths, y_widths=widths, acceleration=None).acceleration is None
+    assert makeMesh().acceleration is None
+
+
+@pytest.mark.parametrize('num_workers, parallel', [(1, 'angle'), (2, 'angle'), (2, 'quadrant')])
+def test_low_memory_matches_baseline(baseline, num_workers, parallel):
+
+    mesh = solve(makeMesh(low_memory=True, num_workers=num_workers, parallel=parallel))
+
+    assert mesh.dancoff == pytest.approx(baseline.dancoff, abs=DANCOFF_TOL)
+    assert np.allclose(mesh.scalar_flux, baseline.scalar_flux, rtol=DANCOFF_TOL)
+
+
+@pytest.mark.parametrize('acceleration', [None, 'anderson'])
+def test_batch_matches_single_solves(acceleration):
+
+    diameters = [0.5, 0.7, 0.9]
+    singles = [solve(makeMesh(fuel_diameter=diameter, acceleration=acceleration)) for diameter in diameters]
+    meshes = [makeMesh(fuel_diameter=diameter, acceleration=acceleration) for diameter in diameters]
+    batch = VariantBatch(meshes)
+    batch.solveSn(False)
+    batch.solveSn(True, NUM_ITER)
+
+    for mesh, single in zip(meshes, singles):
+        assert mesh.converged
+        assert mesh.dancoff == pytest.approx(single.dancoff, abs=DANCOFF_TOL)
+
+
+# a lattice of like pins with reflective boundaries is the pin on its own
+@pytest.mark.parametrize('acceleration', [None, 'anderson'])
+def test_lattice_of_like_pins_matches_baseline(baseline, acceleration):
+
+    lattice = Lattice([[makeMesh(), makeMesh()], [makeMesh(), makeMesh()]], acceleration=acceleration)
+    lattice.solveSn(False, 1)
+    lattice.solveSn(True, NUM_ITER)
+
+    assert lattice.converged
+    assert np.allclose(lattice.dancoff, baseline.dancoff, rtol=0, atol=DANCOFF_TOL)
+
+
+@pytest.mark.parametrize('geometry', ['square', 'circle'])
+def test_response_matches_plain_iteration(geometry):
+
+    plain = solve(makeMesh(geometry=geometry))
+    mesh = solve(makeMesh(geometry=geometry, acceleration='response'))
+
+    assert mesh.response is not None
+    assert mesh.dancoff == pytest.approx(plain.dancoff, abs=DANCOFF_TOL)
+    assert mesh.num_iterations < plain.num_iterations
+
+
+# a mesh too large for the response matrix is solved by plain iteration
+def test_response_falls_back_to_plain_iteration(baseline, monkeypatch):
+
+    monkeypatch.setattr(response, 'MAX_ENTRIES', 0)
+    mesh = solve(makeMesh(acceleration='response'))
+
+    assert mesh.response is None
+    assert mesh.dancoff == baseline.dancoff
+    assert mesh.num_iterations == baseline.num_iterations
+
+
+# a moderator of the given total cross section and scattering ratio c
+def scatteringModerator(sigma_t, c):
+
+    return Material('moderator', sigma_t, 0.0, c * sigma_t)
+
+
+@pytest.mark.parametrize('sigma_t, c', [(1.0, 0.9), (1.0, 0.999), (3.0, 0.99)])
+def test_dsa_matches_source_iteration(sigma_t, c):
+
+    plain = solve(makeMesh(moderator=scatteringModerator(sigma_t, c), dsa=False))
+    mesh = solve(makeMesh(moderator=scatteringModerator(sigma_t, c)))
+
+    assert mesh.dancoff == pytest.approx(plain.dancoff, abs=DANCOFF_TOL)
+    assert mesh.num_iterations <= plain.num_iterations
+
+
+# without DSA a 10 per cm moderator with c = 0.999 takes 175 source and
+# 780 reflective iterations; with DSA both stay below 70 for c up to
+# 0.9999 and cells up to 18 mean free paths thick
+@pytest.mark.parametrize('sigma_t, c', [(10.0, 0.9), (10.0, 0.99), (10.0, 0.999), (10.0, 0.9999),
+                                        (1.0, 0.999), (100.0, 0.999), (200.0, 0.999)])
+def test_dsa_iterations_stay_bounded(sigma_t, c):
+
+    mesh = solve(makeMesh(moderator=scatteringModerator(sigma_t, c)))
+
+    assert mesh.source_iterations <= 80
+    assert mesh.num_iterations <= 80
+
+
+def test_uncoupled_groups_match_one_group(baseline):
+
+    source = 1.0/(4.0*np.pi)
+    mesh = solve(makeMesh(num_groups=2, fuel=Material('fuel', [100.0, 100.0], [source, source]),
+                          moderator=Material('moderator', [0.25, 0.25], [0.0, 0.0])))
+
+    assert np.allclose(mesh.dancoff, baseline.dancoff, rtol=0, atol=DANCOFF_TOL)
+
+
+# a two group pin with a fast source in the fuel and downscatter in the
+# moderator
+def makeDownscatterMesh(**options):
+
+    return makeMesh(num_groups=2, fuel=Material('fuel', [100.0, 50.0], [1.0/(4.0*np.pi), 0.0]),
+                    moderator=Material('moderator', [0.25, 1.0], [0.0, 0.0], [[0.0, 0.2], [0.0, 0.0]]), **options)
+
+
+@pytest.fixture(scope='module')
+def downscatter():
+
+    return solve(makeDownscatterMesh(sweep='cell'))
+
+
+@pytest.mark.parametrize('options', [{'sweep': 'angle'}, {'sweep': 'wavefront'}, {'low_memory': True},
+                                     {'low_memory': True, 'num_workers': 2}])
+def test_downscatter_matches_cell_sweep(downscatter, options):
+
+    mesh = solve(makeDownscatterMesh(**options))
+
+    assert np.allclose(mesh.dancoff, downscatter.dancoff, rtol=0, atol=DANCOFF_TOL)
+    assert np.allclose(mesh.scalar_flux, downscatter.scalar_flux, rtol=DANCOFF_TOL)
+    assert mesh.num_iterations == downscatter.num_iterations
+
+
+# stop a reflective solve after the given iteration by breaking out of the
+# iterator or by closing it
+def stopSolve(mesh, last, close):
+
+    mesh.solveSn(False, 1)
+    iterations = mesh.iterate(True, NUM_ITER)
+    for state in iterations:
+        if state.iteration == last:
+            if close:
+                iterations.close()
+            break
+
+
+@pytest.mark.parametrize('close', [False, True])
+def test_stopping_keeps_the_last_iteration(baseline, tmp_path, close):
+
+    path = str(tmp_path / 'checkpoint')
+    events = []
+    mesh = makeMesh(checkpoint_path=path)
+    mesh.stats.addCallback(lambda event, data: events.append((event, data)))
+    stopSolve(mesh, 4, close)
+    mesh.close()
+
+    # the results are those of a solve that ran out of iterations there
+    assert mesh.num_iterations == 5
+    assert not mesh.converged
+    assert mesh.eps_history == baseline.eps_history[:5]
+    ran_out = makeMesh()
+    ran_out.solveSn(False, 1)
+    ran_out.solveSn(True, 5)
+    assert mesh.dancoff == ran_out.dancoff
+
+    assert checkpoint.readState(path)['iteration'] == 4
+    assert events[-1] == ('solve', {'update': True, 'num_iterations': 5, 'converged': False})
+
+
+def test_loosening_the_tolerance_stops_the_solve(baseline):
+
+    mesh = makeMesh()
+    mesh.solveSn(False, 1)
+    for state in mesh.iterate(True, NUM_ITER):
+        if state.iteration == 2:
+            mesh.tol = 1e-3
+
+    # (the first iteration never converges)
+    last = next(k for k in range(3, len(baseline.eps_history)) if baseline.eps_history[k] < 1e-3)
+    assert mesh.converged
+    assert mesh.num_iterations == last + 1
+
+
+def test_tightening_the_tolerance_continues_the_solve(baseline):
+
+    # (eps falls below 1 at the fourth iteration)
+    mesh = makeMesh()
+    mesh.tol = 1.0
+    mesh.solveSn(False, 1)
+    for state in mesh.iterate(True, NUM_ITER):
+        if state.iteration == 2:
+            mesh.tol = TOLERANCE
+
+    assert mesh.converged
+    assert mesh.dancoff == baseline.dancoff
+    assert mesh.num_iterations == baseline.num_iterations
+
+
+# float32 sweeps converge to tolerance 1e-6 and then agree with float64 to
+# within 1e-6 in the Dancoff factor (2e-7 measured)
+@pytest.mark.parametrize('geometry', ['square', 'circle'])
+def test_float32_matches_float64(geometry):
+
+    meshes = []
+    for dtype in ['float32', 'float64']:
+        mesh = makeMesh(geometry=geometry, dtype=dtype)
+        mesh.tol = 1e-6
+        meshes.append(solve(mesh))
+    single, double = meshes
+
+    for name in ['ang_flux', 'cell_ang_flux', 'cell_source']:
+        assert getattr(single, name).dtype == np.float32
+    assert single.quad['mu'].dtype == np.float32
+    assert all(coef.dtype == np.float32 for coef in single.sweepCoefficients())
+
+    assert single.scalar_flux.dtype == np.float64
+    assert all(np.asarray(value).dtype == np.float64 for value in single.tallies.values())
+    assert np.asarray(single.eps_history).dtype == np.float64
+    assert np.asarray(single.dancoff).dtype == np.float64
+
+    assert single.dancoff == pytest.approx(double.dancoff, abs=1e-6)